@@ -0,0 +1,212 @@
+from __future__ import print_function
+from __future__ import division
+
+import re
+import struct
+import argparse
+import threading
+
+import uci
+import chess
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# One record per analysed move: game number, ply, played move, best move, score type (0 = centipawns,
+# 1 = mate in moves, 2 = unknown) and score from the point of view of the side to move.
+# Moves are stored as integers (see chess.parse_move).
+RECORD = struct.Struct("<IHIIBh")
+
+# Tokens of PGN move text that are not moves
+PGN_SKIP = re.compile(r"^(\d+\.+|\$\d+|1-0|0-1|1/2-1/2|\*)$")
+
+def read_games(path):
+    """
+        Reads the games of a file one by one, as lists of moves in simplified algebraic notation.
+        A file that ends with .pgn is read as PGN, any other file as one game per line,
+        such as "e2e4 e7e5 g1f3" or the "moves e2e4 e7e5 g1f3" line printed by Game.show.
+    """
+    with open(path) as f:
+        if path.lower().endswith(".pgn"):
+            for moves in read_pgn(f):
+                yield moves
+        else:
+            for line in f:
+                moves = line.split()
+                if moves and moves[0] == "moves":
+                    moves = moves[1:]
+                if moves:
+                    yield moves
+    return
+
+def read_pgn(lines):
+    """
+        Reads the games of PGN text one by one, and converts their moves to simplified algebraic notation.
+        Comments and variations are skipped. A game with an illegal move ends before that move.
+    """
+    position = chess.Position().setup()
+    moves = []
+    legal = True
+    comment = False
+    variation = 0
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            if moves:
+                yield moves
+                position = chess.Position().setup()
+                moves = []
+                legal = True
+            continue
+        for token in re.findall(r"\{|\}|\(|\)|[^\s{}()]+", line):
+            if not comment and token.startswith(";"):
+                break
+            if comment:
+                comment = token != "}"
+            elif token == "{":
+                comment = True
+            elif token == "(":
+                variation += 1
+            elif token == ")":
+                variation -= 1
+            elif variation > 0:
+                continue
+            elif token in ("1-0", "0-1", "1/2-1/2", "*"):
+                if moves:
+                    yield moves
+                position = chess.Position().setup()
+                moves = []
+                legal = True
+            elif legal and not PGN_SKIP.match(token):
+                mv = position.parse_san(re.sub(r"^\d+\.+", "", token))
+                if mv is None:
+                    legal = False
+                else:
+                    position.make(mv)
+                    moves.append(chess.move_name(mv))
+    if moves:
+        yield moves
+    return
+
+def analyse_game(engine, moves, move_time=None, depth=None):
+    """
+        Analyses every move of a game.
+        Returns a list of (ply, played move, best move, score) tuples, up to the first illegal move.
+    """
+    position = chess.Position().setup()
+    records = []
+    for ply, m in enumerate(moves):
+        try:
+            mv = chess.parse_move(m)
+        except (IndexError, TypeError):
+            break
+        if mv not in position.legal():
+            break
+        best, score = engine.analyse(moves[:ply], move_time, depth)
+        records.append((ply, mv, chess.parse_move(best), score))
+        position.make(mv)
+    return records
+
+def write_records(f, game, records):
+    """
+        Appends the records of a game to a binary file (see RECORD).
+    """
+    for ply, played, best, score in records:
+        kind, value = 2, 0
+        if score is not None:
+            kind = 1 if score[0] == "mate" else 0
+            value = max(-32768, min(score[1], 32767))
+        f.write(RECORD.pack(game, ply, played, best, kind, value))
+    return
+
+def read_records(path):
+    """
+        Reads an analysis file record by record, as (game, ply, played move, best move, score) tuples,
+        with the moves in simplified algebraic notation and the score as in uci.parse_info.
+    """
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(RECORD.size)
+            if len(data) < RECORD.size:
+                return
+            game, ply, played, best, kind, value = RECORD.unpack(data)
+            score = None
+            if kind < 2:
+                score = ("mate" if kind == 1 else "cp", value)
+            yield game, ply, chess.move_name(played), chess.move_name(best), score
+
+def analyse(paths, output, engines=2, move_time=100, depth=None, pool=None):
+    """
+        Analyses all games of the given files with several engines at the same time, and writes the
+        evaluation of every move to the output file. Games are streamed through a bounded queue, so memory
+        use does not grow with the number of games. Games are numbered in order of reading, but written in
+        order of completion. Returns the number of games.
+
+        :param list paths: Files with games (see read_games).
+        :param string output: Binary file for the results (see RECORD and read_records).
+        :param int engines: Number of engines that analyse in parallel.
+        :param int move_time: Time per move in milliseconds.
+        :param int depth: Depth per move, instead of a time limit.
+    """
+    if pool is None:
+        pool = uci.Pool(engines)
+    jobs = queue.Queue(2 * engines)
+    results = queue.Queue(2 * engines)
+
+    def work():
+        while True:
+            job = jobs.get()
+            if job is None:
+                results.put(None)
+                return
+            game, moves = job
+            records = []
+            try:
+                with pool.lease() as engine:
+                    records = analyse_game(engine, moves, move_time, depth)
+            except IOError as error:
+                print("Game " + str(game) + ": " + str(error))
+            results.put((game, records))
+
+    def write(f):
+        done = 0
+        while done < engines:
+            result = results.get()
+            if result is None:
+                done += 1
+            else:
+                write_records(f, result[0], result[1])
+                f.flush()
+
+    count = 0
+    with open(output, "wb") as f:
+        threads = [threading.Thread(target=work) for k in range(engines)]
+        threads.append(threading.Thread(target=write, args=(f,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for path in paths:
+                for moves in read_games(path):
+                    jobs.put((count, moves))
+                    count += 1
+        finally:
+            for k in range(engines):
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+            pool.close()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyses games with Stockfish.")
+    parser.add_argument("output", help="binary file for the evaluations")
+    parser.add_argument("games", nargs="+", help="PGN files, or files with one game per line")
+    parser.add_argument("-e", "--engines", type=int, default=2, help="number of engines")
+    parser.add_argument("-t", "--time", type=int, default=100, help="time per move in milliseconds")
+    parser.add_argument("-d", "--depth", type=int, default=None, help="depth per move, instead of time")
+    args = parser.parse_args()
+    n = analyse(args.games, args.output, args.engines, args.time, args.depth)
+    print("Analysed " + str(n) + " games.")
@@ -0,0 +1,108 @@
+from __future__ import print_function
+from __future__ import division
+
+import cv2
+import json
+import struct
+import threading
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Header of every record: kind (b"F" for a frame, b"M" for metadata), sequence number and length of the data.
+HEADER = struct.Struct("<cII")
+
+class Archive:
+    """
+        Append-only file of compressed frames and metadata, encoded and written by a background thread.
+        Every record is flushed as soon as it is written, so a crash only loses the records that were
+        still waiting in the queue.
+    """
+
+    # Image format of the frames
+    ext = ".png"
+
+    # Maximal number of records waiting to be written
+    size = 32
+
+    def __init__(self, path, ext=None):
+        if ext is not None:
+            self.ext = ext
+        self.path = path
+        self.count = 0
+        self.records = queue.Queue(self.size)
+        self.file = open(path, "ab")
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def frame(self, img):
+        """
+            Queues a frame for writing. Waits if the queue is full.
+        """
+        self.records.put((b"F", self.count, img))
+        self.count += 1
+        return
+
+    def note(self, meta):
+        """
+            Queues metadata (such as the move that was played) for writing.
+        """
+        self.records.put((b"M", self.count, meta))
+        self.count += 1
+        return
+
+    def run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                return
+            kind, n, payload = record
+            if kind == b"F":
+                ok, data = cv2.imencode(self.ext, payload)
+                data = data.tobytes()
+            else:
+                data = json.dumps(payload).encode("utf-8")
+            self.file.write(HEADER.pack(kind, n, len(data)))
+            self.file.write(data)
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        """
+            Writes the remaining records and closes the file.
+        """
+        if self.thread is not None:
+            self.records.put(None)
+            self.thread.join()
+            self.file.close()
+        self.thread = None
+        return
+
+def read(path):
+    """
+        Reads an archive record by record, as (kind, sequence number, frame or metadata) tuples.
+        A record that was cut off by a crash ends the archive.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, n, length = HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == b"F":
+                yield kind, n, cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+            else:
+                yield kind, n, json.loads(data.decode("utf-8"))
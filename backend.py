@@ -0,0 +1,185 @@
+from __future__ import print_function
+from __future__ import division
+
+import time
+import math
+
+class BrickPi:
+    """
+        Motors of the BrickPi3, behind the interface that the robot uses.
+    """
+
+    def __init__(self):
+        import brickpi3
+        self.BP = brickpi3.BrickPi3()
+        self.PORT_A = self.BP.PORT_A
+        self.PORT_B = self.BP.PORT_B
+        self.PORT_C = self.BP.PORT_C
+        self.PORT_D = self.BP.PORT_D
+
+        # Commands that the motors received: (time, command, port, value)
+        self.log = []
+
+    def get_voltage_battery(self):
+        return self.BP.get_voltage_battery()
+
+    def reset_all(self):
+        self.BP.reset_all()
+        self.log.append((time.time(), "reset", None, None))
+        return
+
+    def set_motor_limits(self, port, power=0, dps=0):
+        self.BP.set_motor_limits(port, power, dps)
+        self.log.append((time.time(), "limits", port, dps))
+        return
+
+    def set_motor_position(self, port, position):
+        self.BP.set_motor_position(port, position)
+        self.log.append((time.time(), "position", port, position))
+        return
+
+    def set_motor_power(self, port, power):
+        self.BP.set_motor_power(port, power)
+        self.log.append((time.time(), "power", port, power))
+        return
+
+    def get_motor_encoder(self, port):
+        return self.BP.get_motor_encoder(port)
+
+    def offset_motor_encoder(self, port, offset):
+        self.BP.offset_motor_encoder(port, offset)
+        return
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, t):
+        time.sleep(t)
+        return
+
+class Simulator:
+    """
+        Simulated motors with the interface of BrickPi, for running the robot without the hardware.
+        Every motor accelerates at a constant rate up to its speed limit, and brakes in time to stop at
+        its target position. The simulation has its own clock, which runs faster than real time, or only
+        advances while the robot sleeps.
+    """
+
+    PORT_A, PORT_B, PORT_C, PORT_D = 1, 2, 4, 8
+
+    # Top speed of a motor without speed limit (degree/second)
+    speed = 1000
+
+    # Acceleration and deceleration of a motor (degree/second^2)
+    accel = 5000
+
+    # Time step of the simulation (seconds)
+    step = 0.001
+
+    # Battery voltage (V)
+    voltage = 9
+
+    def __init__(self, speed=None, accel=None, rate=None, stops=None):
+        """
+            :param float rate: How many times faster than real time the clock runs, or None to advance the
+                clock only while sleeping (as fast as possible).
+            :param dict stops: Range (lo, hi) of positions that a motor can reach, by port (such as the grabber).
+        """
+        if speed is not None:
+            self.speed = speed
+        if accel is not None:
+            self.accel = accel
+        self.rate = rate
+        self.stops = stops or {}
+        self.motors = {}
+        for port in (self.PORT_A, self.PORT_B, self.PORT_C, self.PORT_D):
+            self.motors[port] = {"position": 0., "velocity": 0., "target": None, "power": 0, "dps": 0, "offset": 0}
+        self.now = 0.
+        self.updated = 0.
+        self.started = time.time()
+
+        # Commands that the motors received: (time, command, port, value)
+        self.log = []
+
+    def time(self):
+        if self.rate is None:
+            return self.now
+        return (time.time() - self.started) * self.rate
+
+    def sleep(self, t):
+        if self.rate is None:
+            self.now += t
+        else:
+            time.sleep(t / self.rate)
+        return
+
+    def update(self):
+        """
+            Advances the motors to the current time of the clock.
+        """
+        now = self.time()
+        while self.updated < now:
+            h = min(self.step, now - self.updated)
+            for port, m in self.motors.items():
+                self.advance(port, m, h)
+            self.updated += h
+        return
+
+    def advance(self, port, m, h):
+        if m["target"] is not None:
+            d = m["target"] - m["position"]
+            v = min(m["dps"] or self.speed, self.speed)
+            v = math.copysign(min(v, math.sqrt(2 * self.accel * abs(d))), d)
+        else:
+            v = m["power"] / 100 * self.speed
+        dv = max(-self.accel * h, min(self.accel * h, v - m["velocity"]))
+        m["velocity"] += dv
+        m["position"] += m["velocity"] * h
+
+        # Stop at the target instead of oscillating around it.
+        if m["target"] is not None and abs(m["target"] - m["position"]) < 0.5 and abs(m["velocity"]) <= self.accel * h:
+            m["position"], m["velocity"] = m["target"], 0.
+        if port in self.stops:
+            lo, hi = self.stops[port]
+            if not lo <= m["position"] <= hi:
+                m["position"], m["velocity"] = max(lo, min(hi, m["position"])), 0.
+        return
+
+    def get_voltage_battery(self):
+        return self.voltage
+
+    def reset_all(self):
+        self.update()
+        for m in self.motors.values():
+            m["target"], m["power"], m["dps"], m["velocity"] = None, 0, 0, 0.
+        self.log.append((self.time(), "reset", None, None))
+        return
+
+    def set_motor_limits(self, port, power=0, dps=0):
+        self.update()
+        self.motors[port]["dps"] = dps
+        self.log.append((self.time(), "limits", port, dps))
+        return
+
+    def set_motor_position(self, port, position):
+        self.update()
+        m = self.motors[port]
+        m["target"], m["power"] = position + m["offset"], 0
+        self.log.append((self.time(), "position", port, position))
+        return
+
+    def set_motor_power(self, port, power):
+        self.update()
+        m = self.motors[port]
+        m["target"], m["power"] = None, power
+        self.log.append((self.time(), "power", port, power))
+        return
+
+    def get_motor_encoder(self, port):
+        self.update()
+        m = self.motors[port]
+        return int(round(m["position"] - m["offset"]))
+
+    def offset_motor_encoder(self, port, offset):
+        self.motors[port]["offset"] += offset
+        return
@@ -0,0 +1,242 @@
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import json
+import random
+import argparse
+import timeit
+
+import cv2
+import numpy as np
+
+import chess
+import robot
+import camera
+import archive
+import backend
+import analysis
+import recorder
+
+def random_games(n, length=80, seed=2018):
+    """
+        Plays n games of random legal moves, the same in every run.
+    """
+    rng = random.Random(seed)
+    games = []
+    for k in range(n):
+        position = chess.Position().setup()
+        moves = []
+        for i in range(length):
+            legal = position.legal()
+            if not legal:
+                break
+            mv = rng.choice(legal)
+            position.make(mv)
+            moves.append(chess.move_name(mv))
+        games.append(moves)
+    return games
+
+def measure(f, repeat=3):
+    """
+        Runs f repeat times, and returns the shortest time with the number of operations that f returned.
+    """
+    best, count = None, 0
+    for k in range(repeat):
+        start = timeit.default_timer()
+        count = f()
+        t = timeit.default_timer() - start
+        if best is None or t < best:
+            best = t
+    return best, count
+
+def result(t, count, unit="s"):
+    return {"value": t / max(count, 1), "count": count, "unit": unit}
+
+def bench_game(games, repeat=3):
+    """
+        Measures Game.move, Game.need_lift and Game.find_move over every move of the games.
+    """
+    G = chess.Game()
+    results = {}
+
+    def move():
+        n = 0
+        for moves in games:
+            G.new_game()
+            for m in moves:
+                G.move(m)
+                n += 1
+        return n
+
+    def need_lift():
+        n = 0
+        for moves in games:
+            G.new_game()
+            G.lift_cache.clear()
+            for m in moves:
+                G.need_lift(m)
+                G.position.make(chess.parse_move(m))
+                n += 1
+        return n
+
+    def find_move():
+        n = 0
+        for moves in games:
+            G.new_game()
+            for m in moves:
+                mv = chess.parse_move(m)
+                squares = [(s & 7, s >> 4) for s in G.position.footprint(mv)]
+                G.find_move(squares)
+                G.position.make(mv)
+                n += 1
+        return n
+
+    for name, f in (("game.move", move), ("game.need_lift", need_lift), ("game.find_move", find_move)):
+        results[name] = result(*measure(f, repeat))
+    return results
+
+def board(offset=0, seed=0):
+    """
+        Returns a synthetic 640x480 picture of a board with four green stickers, as the camera takes it.
+    """
+    rng = np.random.RandomState(seed)
+    img = rng.randint(100, 140, (480,640,3)).astype(np.uint8)
+    for (x,y) in [(100,60),(540,60),(100,420),(540,420)]:
+        cv2.circle(img,(x+offset,y),8,(0,200,0),-1)
+    return img
+
+def warped(n, seed=0):
+    """
+        Returns n synthetic warped gray scale pictures, in which one or two squares change every time.
+    """
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, 256, (400,400)).astype(np.uint8)
+    frames = [img]
+    for k in range(n - 1):
+        img = img.copy()
+        for i in range(rng.randint(1, 3)):
+            x, y = rng.randint(0, 8, 2)
+            img[50*y:50*y+50, 50*x:50*x+50] = rng.randint(0, 256)
+        frames.append(img)
+    return frames
+
+def bench_camera(pictures=None, frames=None, repeat=3):
+    """
+        Measures Camera.warp on pictures of the camera, and Camera.changes on consecutive warped frames.
+    """
+    C = camera.Camera()
+    C.s = False
+    C.calibration = None
+    if pictures is None:
+        pictures = [board(seed=k) for k in range(20)]
+    if frames is None:
+        frames = warped(50)
+    C.calibrate(pictures[0])
+
+    def warp():
+        for img in pictures:
+            C.warp(img)
+        return len(pictures)
+
+    def changes():
+        for k in range(1, len(frames)):
+            C.L.append(frames[k-1])
+            C.L.append(frames[k])
+            C.changes()
+        return len(frames) - 1
+
+    return {"camera.warp": result(*measure(warp, repeat)), "camera.changes": result(*measure(changes, repeat))}
+
+def bench_robot(games, moves=20):
+    """
+        Measures Robot.move on the simulated motors, for the first moves of the games.
+        Reports the simulated duration of a move, and the time it takes to simulate it.
+    """
+    G = chess.Game()
+    simulated = 0
+    n = 0
+    start = timeit.default_timer()
+    for game in games:
+        BP = backend.Simulator(stops={backend.Simulator.PORT_D: (-30, 30)})
+        R = robot.Robot(BP)
+        G.new_game()
+        for m in game[:moves]:
+            t = BP.time()
+            R.move(*(G.get_move(m) + (m[4:],)))
+            simulated += BP.time() - t
+            G.move(m)
+            n += 1
+    wall = timeit.default_timer() - start
+    return {"robot.move": result(simulated, n), "robot.simulation": result(wall, n)}
+
+def bench_replay(sessions):
+    """
+        Measures the replay of recorded games (see recorder.py), per move.
+    """
+    wall, n = 0, 0
+    for path in sessions:
+        moves, mismatches, t, simulated = recorder.replay(path)
+        wall += t
+        n += moves
+    return {"replay": result(wall, n)}
+
+def compare(results, baseline, tolerance):
+    """
+        Prints every result next to its baseline, and returns the names of the results that are more than
+        tolerance (a fraction) slower.
+    """
+    slower = []
+    print("%-20s %12s %12s %8s" % ("benchmark", "value", "baseline", "ratio"))
+    for name in sorted(results):
+        value = results[name]["value"]
+        if name not in baseline:
+            print("%-20s %12.6f %12s %8s" % (name, value, "-", "-"))
+            continue
+        base = baseline[name]["value"]
+        ratio = value / base if base > 0 else 1
+        print("%-20s %12.6f %12.6f %8.2f" % (name, value, base, ratio))
+        if ratio > 1 + tolerance:
+            slower.append(name)
+    return slower
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the chess, vision and motion code without hardware.")
+    parser.add_argument("-g", "--games", nargs="*", default=[], help="PGN files, or files with one game per line (default: random games)")
+    parser.add_argument("-p", "--pictures", nargs="*", default=[], help="pictures of the camera for Camera.warp (default: synthetic)")
+    parser.add_argument("-a", "--archive", help="archive of a game (see archive.py) for Camera.changes (default: synthetic)")
+    parser.add_argument("-s", "--sessions", nargs="*", default=[], help="recorded games to replay (see recorder.py)")
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument("-b", "--baseline", help="JSON file with earlier results to compare with")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="fraction that a result may be slower than the baseline")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs, of which the fastest counts")
+    args = parser.parse_args()
+
+    games = []
+    for path in args.games:
+        games.extend(analysis.read_games(path))
+    if not games:
+        games = random_games(20)
+    pictures = [cv2.imread(path) for path in args.pictures] or None
+    frames = None
+    if args.archive:
+        frames = [data for kind, n, data in archive.read(args.archive) if kind == b"F"]
+
+    results = {}
+    results.update(bench_game(games, args.repeat))
+    results.update(bench_camera(pictures, frames, args.repeat))
+    results.update(bench_robot(games[:5]))
+    if args.sessions:
+        results.update(bench_replay(args.sessions))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    slower = compare(results, baseline, args.tolerance)
+    if slower:
+        print("Slower than the baseline: " + ", ".join(slower))
+        sys.exit(1)
@@ -0,0 +1,148 @@
+from __future__ import print_function
+from __future__ import division
+
+import os
+import mmap
+import random
+import struct
+import argparse
+
+import chess
+import analysis
+
+# Entry of the book, as in Polyglot: position hash, move, weight and learn value, big-endian.
+# The hash is the Zobrist hash of chess.Position, so books of other programs cannot be used.
+ENTRY = struct.Struct(">QHHI")
+
+# Promotion pieces in the order of Polyglot
+PROMOTIONS = "_nbrq"
+
+def encode(position, mv):
+    """
+        Encodes an integer move (see chess.parse_move) as a Polyglot move.
+        Castling is encoded as the king taking its own rook.
+    """
+    s1 = mv & 127
+    s2 = (mv >> 7) & 127
+    if position[s1] | 32 == chess.KING and abs((s2 & 7) - (s1 & 7)) == 2:
+        s2 = (s1 & 0x70) + (7 if s2 > s1 else 0)
+    promotion = PROMOTIONS.index(chr(mv >> 14)) if mv >> 14 else 0
+    return (s2 & 7) | (s2 >> 4) << 3 | (s1 & 7) << 6 | (s1 >> 4) << 9 | promotion << 12
+
+def decode(position, move):
+    """
+        Decodes a Polyglot move into an integer move (see chess.parse_move).
+    """
+    s2 = (move & 7) + 16 * ((move >> 3) & 7)
+    s1 = ((move >> 6) & 7) + 16 * ((move >> 9) & 7)
+    if position[s1] | 32 == chess.KING and position[s2] | 32 == chess.ROOK and (position[s1] >= 97) == (position[s2] >= 97):
+        s2 = s1 + (2 if s2 > s1 else -2)
+    mv = s1 | s2 << 7
+    if move >> 12:
+        mv |= ord(PROMOTIONS[move >> 12]) << 14
+    return mv
+
+class Book:
+    """
+        Opening book in a sorted binary file, which is memory-mapped and searched by position hash.
+    """
+
+    # Default book file
+    path = "book.bin"
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self.data = None
+        self.size = 0
+        self.random = random.Random()
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= ENTRY.size:
+            with open(self.path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = len(self.data) // ENTRY.size
+
+    def find(self, position):
+        """
+            Returns the legal moves of the book in the position, as a list of (move, weight) pairs.
+        """
+        key = position.hash
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from(">Q", self.data, mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        legal = None
+        while lo < self.size:
+            k, move, weight, learn = ENTRY.unpack_from(self.data, lo * ENTRY.size)
+            if k != key:
+                break
+            if legal is None:
+                legal = position.legal()
+            mv = decode(position, move)
+            if mv in legal and weight > 0:
+                moves.append((mv, weight))
+            lo += 1
+        return moves
+
+    def choose(self, position, skill_level=20):
+        """
+            Chooses a move of the book at random, in simplified algebraic notation, or None if the position
+            is not in the book. The higher the skill level (0,...,20), the more the choice favours the moves
+            with the largest weight.
+        """
+        moves = self.find(position)
+        if not moves:
+            return None
+        power = 0.5 + skill_level / 10
+        weights = [w ** power for mv, w in moves]
+        r = self.random.random() * sum(weights)
+        for (mv, w), weight in zip(moves, weights):
+            r -= weight
+            if r < 0:
+                return chess.move_name(mv)
+        return chess.move_name(moves[-1][0])
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.data = None
+        self.size = 0
+        return
+
+def build(paths, output, plies=20):
+    """
+        Builds a book from the first moves of games, weighted by how often each move was played.
+
+        :param list paths: Files with games (see analysis.read_games).
+        :param string output: Book file.
+        :param int plies: Number of moves of each game that go into the book.
+    """
+    counts = {}
+    for path in paths:
+        for moves in analysis.read_games(path):
+            position = chess.Position().setup()
+            for m in moves[:plies]:
+                if len(m) < 4:
+                    break
+                mv = chess.parse_move(m)
+                if mv not in position.legal():
+                    break
+                key = (position.hash, encode(position, mv))
+                counts[key] = counts.get(key, 0) + 1
+                position.make(mv)
+    with open(output, "wb") as f:
+        for (key, move) in sorted(counts):
+            f.write(ENTRY.pack(key, move, min(counts[(key, move)], 65535), 0))
+    return len(counts)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds an opening book from games.")
+    parser.add_argument("output", help="book file")
+    parser.add_argument("games", nargs="+", help="PGN files, or files with one game per line")
+    parser.add_argument("-p", "--plies", type=int, default=20, help="number of moves per game")
+    args = parser.parse_args()
+    n = build(args.games, args.output, args.plies)
+    print("Wrote " + str(n) + " entries.")
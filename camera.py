@@ -1,11 +1,11 @@
 from __future__ import print_function 
 from __future__ import division
 
-import io
+import os
 import cv2
-import time
-import picamera
-import picamera.array
+import capture
+import tracing
+import collections
 import numpy as np
 
 class Camera:
@@ -13,12 +13,21 @@ class Camera:
     # Show
     s = True
 
-    # List of pictures
-    L = []
+    # Number of pictures that are kept in memory
+    depth = 16
 
-    # Time to wait before taking picture
+    # Archive that every picture is written to in the background (see archive.py), or None
+    archive = None
+
+    # Time to wait for the exposure to settle when the camera starts
     t = 0.5
 
+    # Source of the frames (see capture.py), or None for the Pi camera
+    source = None
+
+    # Continuous capture from the source, started at the first picture
+    session = None
+
     # Color of dots
     h = 50
 
@@ -28,31 +37,107 @@ class Camera:
     # Threshold for mean
     tm = 10
 
+    # Pixels to ignore at the edge of every square
+    margin = 0
+
+    # File that stores the calibration of the board, or None to calibrate at every start
+    calibration = "calibration.npz"
+
+    # Perspective transform of the board, and the positions of the stickers it was computed from
+    M = None
+    stickers = None
+
+    # Distance (pixels) that a sticker may move before the board is calibrated again
+    drift = 4
+
+    # Half the size of the window around a sticker that is checked for drift (pixels)
+    window = 12
+
+    # Minimal number of sticker pixels in a window
+    area = 20
+
+    def __init__(self, depth=None):
+        if depth is not None:
+            self.depth = depth
+
+        # Last pictures
+        self.L = collections.deque(maxlen=self.depth)
+
     def save(self,name):
         """
-            Saves all pictures to disk.
+            Saves the pictures in memory to disk.
         """
         for k, img in enumerate(self.L):
             cv2.imwrite(name + format(k, '03') + ".jpg", img)
         return
         
+    @tracing.timed("camera.picture")
     def picture(self):
         """
             Takes a picture, appends it to the list.
         """
-        with picamera.PiCamera() as camera:
-            rawCapture = picamera.array.PiRGBArray(camera)
-            time.sleep(self.t)
-            camera.capture(rawCapture, format='bgr')
-            img = rawCapture.array
-            if self.s:
-                self.show(img)
-            warp = self.warp(img)
-            gray = cv2.cvtColor(warp,cv2.COLOR_BGR2GRAY)
-            blur = cv2.blur(gray,(5,5))
-            if self.s:
-                self.show(blur)
-            self.L.append(blur)
+        img = self.start().frame()
+        if self.s:
+            self.show(img)
+        blur = self.process(img)
+        if self.s:
+            self.show(blur)
+        self.add(blur)
+        return
+
+    def add(self,img):
+        """
+            Appends a picture to the list, and to the archive if there is one.
+        """
+        self.L.append(img)
+        if self.archive is not None:
+            self.archive.frame(img)
+        return
+
+    def note(self,meta):
+        """
+            Writes metadata, such as the move that was played, to the archive if there is one.
+        """
+        if self.archive is not None:
+            self.archive.note(meta)
+        return
+
+    def process(self,img):
+        """
+            Warps a picture onto the board, and converts it to a blurred gray scale image.
+        """
+        warp = self.warp(img)
+        gray = cv2.cvtColor(warp,cv2.COLOR_BGR2GRAY)
+        return cv2.blur(gray,(5,5))
+
+    def start(self):
+        """
+            Starts capturing frames continuously, if that did not happen yet.
+        """
+        if self.session is None:
+            source = self.source
+            if source is None:
+                source = capture.PiCameraSource(settle=self.t)
+            self.session = capture.Session(source).start()
+        return self.session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        """
+            Stops capturing frames, and finishes the archive.
+        """
+        if self.session is not None:
+            self.session.stop()
+        self.session = None
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = None
         return
        
     def show(self,img):
@@ -63,13 +148,38 @@ class Camera:
         cv2.destroyAllWindows()
         return
 
-    def changes(self):
+    def scores(self,img,margin=None):
+        """
+            Computes the mean of every square of a 400x400 image in one vectorized pass.
+            Returns an 8x8 matrix, indexed by column x and row y.
+
+            :param int margin: Pixels to ignore at the edge of every square (default self.margin).
+        """
+        if margin is None:
+            margin = self.margin
+        blocks = img.reshape(8,50,8,50)
+        if margin > 0:
+            blocks = blocks[:,margin:50-margin,:,margin:50-margin]
+        n = (50-2*margin)**2
+        return blocks.sum(axis=(1,3), dtype=np.uint32).T / n
+
+    def changes(self,margin=None):
         """
             Computes a list of squares that changes between the last two images in the list.
+            Returns the list of squares and the 8x8 matrix of scores (see scores).
+
+            :param int margin: Pixels to ignore at the edge of every square (default self.margin).
+        """
+        return self.compare(self.L[-2],self.L[-1],margin)
+
+    @tracing.timed("camera.changes")
+    def compare(self,img1,img2,margin=None):
+        """
+            Computes a list of squares that changes between two images, as changes does.
         """
         
         # Take the absolute difference of the these images
-        diff = cv2.absdiff(self.L[-1],self.L[-2])
+        diff = cv2.absdiff(img2,img1)
         
         # Transform the gray scale difference to black and white via thresholding
         ret,thresh = cv2.threshold(diff,self.td,255,cv2.THRESH_BINARY)
@@ -77,21 +187,15 @@ class Camera:
         if self.s:
             self.show(thresh)
 
-        # Iterate over the usual locations of the squares to find what changed
-        squares = []
-        for x in range(8):
-            for y in range(8):
-                mask = np.zeros((400,400), np.uint8)
-                cv2.rectangle(mask, (50*x,50*y), (50*(x+1),50*(y+1)), 255, -1)
-                m = cv2.mean(thresh, mask)
-                #print(x,y,m[0])
-                if (m[0] > self.tm):
-                    squares.append((x,y))    
+        # Compute the mean of every square at once to find what changed
+        scores = self.scores(thresh, margin)
+        xs, ys = np.nonzero(scores > self.tm)
+        squares = list(zip(xs.tolist(), ys.tolist()))
         
         #if len(squares) > 2:
         #    self.show(thresh)
         
-        return squares
+        return squares, scores
         
     def changes1(self):
         """
@@ -99,7 +203,7 @@ class Camera:
         """
         
         # Convert to gray scale
-        img1, img2 = self.L[-2:]
+        img1, img2 = self.L[-2], self.L[-1]
         img1_gray = cv2.cvtColor(img1,cv2.COLOR_BGR2GRAY)
         img2_gray = cv2.cvtColor(img2,cv2.COLOR_BGR2GRAY)
 
@@ -156,20 +260,15 @@ class Camera:
         self.show(sq1)
         #self.show(square)
 
-        # Iterate over the usual locations of the squares to find what changed
-        squares = []
-        for x in range(8):
-            for y in range(8):
-                mask = np.zeros((400,400), np.uint8)
-                cv2.rectangle(mask, (50*x,50*y), (50*(x+1),50*(y+1)), 255, -1)
-                m = cv2.mean(square, mask)
-                if (m[0] > 5):
-                    squares.append((x,y))    
+        # Compute the mean of every square at once to find what changed
+        scores = self.scores(square)
+        xs, ys = np.nonzero(scores > 5)
+        squares = list(zip(xs.tolist(), ys.tolist()))
         
         if len(squares) > 2:
             self.show(square)
         
-        return squares
+        return squares, scores
         
     def getBlobs(self,img):
         # Convert BGR to HSV
@@ -238,15 +337,72 @@ class Camera:
         return rect
         
     def warp(self,img):
+        """
+            Transforms the picture to a 400x400 image of the board.
+            The transform is computed once and cached on disk. It is only computed again if the stickers moved,
+            not while some of them are hidden (for instance by a hand).
+        """
+        if self.M is None:
+            self.load()
+        if self.M is None or self.drifted(img):
+            self.calibrate(img)
+        return cv2.warpPerspective(img,self.M,(400,400))
+
+    def calibrate(self,img):
+        """
+            Computes the perspective transform from the green stickers in the picture, and saves it.
+            Returns False if not all four stickers are visible and an earlier transform is kept.
+        """
         # Find the green stickers
         blob = self.getBlobs(img)
 
         # Calculate the key points
         keypoints = self.getKeyPoints(blob)
+        if len(keypoints) != 4 and self.M is not None:
+            return False
         
         # Calculate the perspective transform
         pts1 = self.order(keypoints)
         pts2 = np.float32([[-28,22],[428,22],[-29,375],[426,373]])
-        M = cv2.getPerspectiveTransform(pts1,pts2)
-        
-        return cv2.warpPerspective(img,M,(400,400))
+        self.M = cv2.getPerspectiveTransform(pts1,pts2)
+        self.stickers = pts1
+        if self.calibration is not None:
+            np.savez(self.calibration, M=self.M, stickers=self.stickers)
+        return True
+
+    def load(self):
+        """
+            Loads the perspective transform from disk, if it was saved before.
+        """
+        if self.calibration is not None and os.path.exists(self.calibration):
+            data = np.load(self.calibration)
+            self.M = data["M"]
+            self.stickers = data["stickers"]
+        return
+
+    def drifted(self,img):
+        """
+            Checks whether any sticker moved away from where it was at calibration.
+            Only a small window around every sticker is examined. A sticker that is not visible in its window
+            is taken to be hidden, unless all of them are.
+        """
+        lower = np.array([self.h-10,50,50])
+        upper = np.array([self.h+10,255,255])
+        r = self.window
+        visible = 0
+        for (x,y) in self.stickers:
+            x0 = max(int(round(x))-r, 0)
+            y0 = max(int(round(y))-r, 0)
+            patch = img[y0:y0+2*r, x0:x0+2*r]
+            if patch.size == 0:
+                return True
+            mask = cv2.inRange(cv2.cvtColor(patch, cv2.COLOR_BGR2HSV), lower, upper)
+            m = cv2.moments(mask, True)
+            if m["m00"] < self.area:
+                continue
+            visible += 1
+            dx = x0 + m["m10"]/m["m00"] - x
+            dy = y0 + m["m01"]/m["m00"] - y
+            if dx*dx + dy*dy > self.drift*self.drift:
+                return True
+        return visible == 0
@@ -0,0 +1,184 @@
+from __future__ import print_function
+from __future__ import division
+
+import time
+import threading
+import numpy as np
+
+class PiCameraSource:
+    """
+        Frames of the Raspberry Pi camera, captured through the video port.
+    """
+
+    def __init__(self, resolution=None, settle=0.5):
+        self.resolution = resolution
+        self.settle = settle
+        self.camera = None
+        self.shape = None
+        self.size = None
+
+    def open(self):
+        import picamera
+        self.camera = picamera.PiCamera()
+        if self.resolution is not None:
+            self.camera.resolution = self.resolution
+        w, h = self.camera.resolution
+        self.size = (h, w)
+
+        # The camera writes whole blocks of 32x16 pixels.
+        self.shape = ((h + 15) // 16 * 16, (w + 31) // 32 * 32, 3)
+
+        # Let the exposure settle
+        time.sleep(self.settle)
+        return
+
+    def read(self, out):
+        self.camera.capture(out, format='bgr', use_video_port=True)
+        return
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.close()
+        self.camera = None
+        return
+
+class FrameSource:
+    """
+        Frames from a list of images, repeated in turn, for running without the camera.
+    """
+
+    def __init__(self, frames, fps=30):
+        self.frames = frames
+        self.fps = fps
+        self.k = 0
+        self.shape = None
+        self.size = None
+
+    def open(self):
+        self.shape = self.frames[0].shape
+        self.size = self.shape[:2]
+        self.k = 0
+        self.last = time.time()
+        return
+
+    def read(self, out):
+        if self.fps:
+            wait = self.last + 1 / self.fps - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.last = time.time()
+        np.copyto(out, self.frames[self.k % len(self.frames)])
+        self.k += 1
+        return
+
+    def close(self):
+        return
+
+class FileSource(FrameSource):
+    """
+        Frames from image files on disk, such as the pictures saved by Camera.save.
+    """
+
+    def __init__(self, paths, fps=30):
+        FrameSource.__init__(self, [], fps)
+        self.paths = paths
+
+    def open(self):
+        import cv2
+        self.frames = [cv2.imread(path) for path in self.paths]
+        FrameSource.open(self)
+        return
+
+class Session:
+    """
+        Captures frames continuously on a background thread into a ring of preallocated buffers.
+    """
+
+    # Number of buffers
+    depth = 4
+
+    def __init__(self, source, depth=None):
+        self.source = source
+        if depth is not None:
+            self.depth = depth
+        self.buffers = []
+        self.index = 0
+        self.count = 0
+        self.running = False
+        self.error = None
+        self.thread = None
+        self.lock = threading.Condition()
+
+    def start(self):
+        """
+            Opens the source and starts capturing.
+        """
+        if self.running:
+            return self
+        self.source.open()
+        self.buffers = [np.empty(self.source.shape, np.uint8) for k in range(self.depth)]
+        self.count = 0
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            while self.running:
+                i = (self.index + 1) % self.depth
+                self.source.read(self.buffers[i])
+                with self.lock:
+                    self.index = i
+                    self.count += 1
+                    self.lock.notify_all()
+        except Exception as error:
+            with self.lock:
+                self.error = error
+                self.running = False
+                self.lock.notify_all()
+        return
+
+    def frame(self, fresh=True, out=None, timeout=5):
+        """
+            Returns a copy of a captured frame.
+
+            :param bool fresh: Wait for a frame that was exposed after the call, instead of the latest frame.
+            :param out: Array to copy the frame into, instead of a new array.
+            :param float timeout: Seconds to wait at most.
+        """
+        with self.lock:
+            n = self.count + (2 if fresh else 0)
+            deadline = time.time() + timeout
+            while self.count < max(n, 1):
+                if not self.running:
+                    raise IOError("Camera stopped: " + str(self.error))
+                if time.time() >= deadline:
+                    raise IOError("No frame within " + str(timeout) + "s")
+                self.lock.wait(deadline - time.time())
+            h, w = self.source.size
+            img = self.buffers[self.index][:h,:w]
+            if out is None:
+                return img.copy()
+            np.copyto(out, img)
+            return out
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def stop(self):
+        """
+            Stops capturing and closes the source.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+        self.source.close()
+        return
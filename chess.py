@@ -1,171 +1,728 @@
-import numpy as np
-import subprocess
+import uci
+import math
+import random
+import tracing
+import collections
+
+# Squares are indices into a 0x88 board: x + 16*y, with x the column (0=a) and y the row (0=1).
+# An index s is on the board if and only if s & 0x88 == 0.
+SQUARES = [x + 16*y for y in range(8) for x in range(8)]
+
+# Algebraic names of the squares, indexed by 0x88 square.
+NAMES = [""] * 128
+for _s in SQUARES:
+    NAMES[_s] = chr((_s & 7) + 97) + chr((_s >> 4) + 49)
+
+# Empty square
+EMPTY = 0
+
+# Piece codes of white pieces. A black piece has the same code minus 32 (uppercase).
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = [ord(p) for p in "pnbrqk"]
+
+# Directions on the 0x88 board
+KNIGHT_STEPS = (33, 31, 18, 14, -14, -18, -31, -33)
+BISHOP_STEPS = (17, 15, -15, -17)
+ROOK_STEPS = (16, 1, -1, -16)
+KING_STEPS = BISHOP_STEPS + ROOK_STEPS
+
+# Castling rights: white king side, white queen side, black king side, black queen side.
+WK, WQ, BK, BQ = 1, 2, 4, 8
+
+# Castling rights that survive a move from or to a square.
+CASTLE_MASK = [15] * 128
+CASTLE_MASK[0] = 15 & ~WQ
+CASTLE_MASK[4] = 15 & ~(WK | WQ)
+CASTLE_MASK[7] = 15 & ~WK
+CASTLE_MASK[112] = 15 & ~BQ
+CASTLE_MASK[116] = 15 & ~(BK | BQ)
+CASTLE_MASK[119] = 15 & ~BK
+
+# Zobrist keys, from a fixed seed such that hashes are the same in every run.
+_random = random.Random(2018)
+ZOBRIST_PIECES = {}
+for _p in "pnbrqkPNBRQK":
+    ZOBRIST_PIECES[ord(_p)] = [_random.getrandbits(64) for _s in range(128)]
+ZOBRIST_CASTLING = [_random.getrandbits(64) for _c in range(16)]
+ZOBRIST_EP = [_random.getrandbits(64) for _x in range(8)]
+ZOBRIST_BLACK = _random.getrandbits(64)
+
+def square(m, i=0):
+    """
+        Reads the square at offset i of a move string, without slicing the string.
+
+        :param string m: Simplified algebraic notation of a move (such as g1f3).
+        :param int i: Offset of the square in the string (0 for the source, 2 for the target).
+    """
+    return (ord(m[i]) - 97) + 16 * (ord(m[i+1]) - 49)
+
+def parse_move(m):
+    """
+        Encodes a move string as an integer: source | target << 7 | promotion << 14.
+
+        :param string m: Simplified algebraic notation of the move (such as g1f3, e1g1 (0-0), d7d8q (promotion)).
+    """
+    mv = square(m, 0) | square(m, 2) << 7
+    if len(m) == 5:
+        mv |= ord(m[4].lower()) << 14
+    return mv
+
+def move_name(mv):
+    """
+        Decodes an integer move into simplified algebraic notation.
+    """
+    m = NAMES[mv & 127] + NAMES[(mv >> 7) & 127]
+    if mv >> 14:
+        m += chr(mv >> 14)
+    return m
+
+class Position(object):
+    """
+        Pieces on the board, stored in a 128 byte 0x88 array, together with the side to move,
+        the castling rights, the en passant square, the squares of both kings and the Zobrist hash.
+        Every piece is stored as its character code, lowercase for white and uppercase for black.
+        An empty square is 0.
+    """
+
+    __slots__ = ("board", "white", "castling", "ep", "kings", "hash")
+
+    def __init__(self, board=None):
+        if board is None:
+            self.board = bytearray(128)
+        else:
+            self.board = bytearray(board)
+        self.white = True
+        self.castling = 0
+        self.ep = -1
+        self.kings = [-1, -1]
+        for s in SQUARES:
+            if self.board[s] == KING:
+                self.kings[0] = s
+            elif self.board[s] == KING - 32:
+                self.kings[1] = s
+        self.hash = self.zobrist()
+
+    def setup(self):
+        """
+            Places the pieces in the initial position.
+        """
+        self.board = bytearray(128)
+        for x, p in enumerate("rnbqkbnr"):
+            self.board[x] = ord(p)
+            self.board[x + 16] = PAWN
+            self.board[x + 96] = PAWN - 32
+            self.board[x + 112] = self.board[x] - 32
+        self.white = True
+        self.castling = WK | WQ | BK | BQ
+        self.ep = -1
+        self.kings = [4, 116]
+        self.hash = self.zobrist()
+        return self
+
+    def copy(self):
+        p = Position()
+        p.board = bytearray(self.board)
+        p.white = self.white
+        p.castling = self.castling
+        p.ep = self.ep
+        p.kings = list(self.kings)
+        p.hash = self.hash
+        return p
+
+    def zobrist(self):
+        """
+            Computes the Zobrist hash of the position from scratch.
+            The hash is kept up to date incrementally by make and unmake.
+        """
+        h = ZOBRIST_CASTLING[self.castling]
+        for s in SQUARES:
+            if self.board[s] != EMPTY:
+                h ^= ZOBRIST_PIECES[self.board[s]][s]
+        if self.ep >= 0:
+            h ^= ZOBRIST_EP[self.ep & 7]
+        if not self.white:
+            h ^= ZOBRIST_BLACK
+        return h
+
+    def __getitem__(self, s):
+        return self.board[s]
+
+    def __setitem__(self, s, p):
+        self.board[s] = p
+
+    def __eq__(self, other):
+        return (isinstance(other, Position) and self.board == other.board and self.white == other.white
+                and self.castling == other.castling and self.ep == other.ep)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def piece(self, s):
+        """
+            Returns the piece on square s as a string, or the empty string if there is none.
+        """
+        p = self.board[s]
+        if p == EMPTY:
+            return ""
+        return chr(p)
+
+    def occupied(self, x, y):
+        """
+            Checks whether the square at column x and row y holds a piece.
+        """
+        return self.board[x + 16*y] != EMPTY
+
+    def attacked(self, s, white):
+        """
+            Checks whether square s is attacked by a piece of the given colour.
+        """
+        b = self.board
+        d = 0 if white else 32
+
+        # Pawns
+        if white:
+            if (s - 15) & 0x88 == 0 and b[s - 15] == PAWN:
+                return True
+            if (s - 17) & 0x88 == 0 and b[s - 17] == PAWN:
+                return True
+        else:
+            if (s + 15) & 0x88 == 0 and b[s + 15] == PAWN - 32:
+                return True
+            if (s + 17) & 0x88 == 0 and b[s + 17] == PAWN - 32:
+                return True
+
+        # Knights and king
+        for step in KNIGHT_STEPS:
+            t = s + step
+            if t & 0x88 == 0 and b[t] == KNIGHT - d:
+                return True
+        for step in KING_STEPS:
+            t = s + step
+            if t & 0x88 == 0 and b[t] == KING - d:
+                return True
+
+        # Sliding pieces
+        for step in BISHOP_STEPS:
+            t = s + step
+            while t & 0x88 == 0:
+                p = b[t]
+                if p != EMPTY:
+                    if p == BISHOP - d or p == QUEEN - d:
+                        return True
+                    break
+                t += step
+        for step in ROOK_STEPS:
+            t = s + step
+            while t & 0x88 == 0:
+                p = b[t]
+                if p != EMPTY:
+                    if p == ROOK - d or p == QUEEN - d:
+                        return True
+                    break
+                t += step
+        return False
+
+    def in_check(self):
+        """
+            Checks whether the side to move is in check.
+        """
+        k = self.kings[0 if self.white else 1]
+        return k >= 0 and self.attacked(k, not self.white)
+
+    def generate(self):
+        """
+            Generates all pseudo-legal moves of the side to move, as integers (see parse_move).
+        """
+        b = self.board
+        white = self.white
+        moves = []
+        append = moves.append
+        for s in SQUARES:
+            p = b[s]
+            if p == EMPTY or (p >= 97) != white:
+                continue
+            kind = p | 32
+
+            if kind == PAWN:
+                up = 16 if white else -16
+                last = 0x70 if white else 0x00
+                t = s + up
+                if b[t] == EMPTY:
+                    if t & 0x70 == last:
+                        for q in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            append(s | t << 7 | q << 14)
+                    else:
+                        append(s | t << 7)
+                        if s & 0x70 == (0x10 if white else 0x60) and b[t + up] == EMPTY:
+                            append(s | (t + up) << 7)
+                for t in (s + up - 1, s + up + 1):
+                    if t & 0x88:
+                        continue
+                    q = b[t]
+                    if (q != EMPTY and (q >= 97) != white) or t == self.ep:
+                        if t & 0x70 == last:
+                            for q in (QUEEN, ROOK, BISHOP, KNIGHT):
+                                append(s | t << 7 | q << 14)
+                        else:
+                            append(s | t << 7)
+
+            elif kind == KNIGHT or kind == KING:
+                for step in (KNIGHT_STEPS if kind == KNIGHT else KING_STEPS):
+                    t = s + step
+                    if t & 0x88 == 0:
+                        q = b[t]
+                        if q == EMPTY or (q >= 97) != white:
+                            append(s | t << 7)
+
+            else:
+                if kind == BISHOP:
+                    steps = BISHOP_STEPS
+                elif kind == ROOK:
+                    steps = ROOK_STEPS
+                else:
+                    steps = KING_STEPS
+                for step in steps:
+                    t = s + step
+                    while t & 0x88 == 0:
+                        q = b[t]
+                        if q == EMPTY:
+                            append(s | t << 7)
+                        else:
+                            if (q >= 97) != white:
+                                append(s | t << 7)
+                            break
+                        t += step
+
+        # Castling
+        c = self.castling
+        if white and c & (WK | WQ) and self.kings[0] == 4:
+            if c & WK and b[5] == EMPTY and b[6] == EMPTY and b[7] == ROOK:
+                if not (self.attacked(4, False) or self.attacked(5, False) or self.attacked(6, False)):
+                    append(4 | 6 << 7)
+            if c & WQ and b[1] == EMPTY and b[2] == EMPTY and b[3] == EMPTY and b[0] == ROOK:
+                if not (self.attacked(4, False) or self.attacked(3, False) or self.attacked(2, False)):
+                    append(4 | 2 << 7)
+        if not white and c & (BK | BQ) and self.kings[1] == 116:
+            if c & BK and b[117] == EMPTY and b[118] == EMPTY and b[119] == ROOK - 32:
+                if not (self.attacked(116, True) or self.attacked(117, True) or self.attacked(118, True)):
+                    append(116 | 118 << 7)
+            if c & BQ and b[113] == EMPTY and b[114] == EMPTY and b[115] == EMPTY and b[112] == ROOK - 32:
+                if not (self.attacked(116, True) or self.attacked(115, True) or self.attacked(114, True)):
+                    append(116 | 114 << 7)
+        return moves
+
+    def legal(self):
+        """
+            Generates all legal moves of the side to move, as integers (see parse_move).
+            Out of check, only moves of the king, of pinned pieces and en passant captures can expose the
+            king, so only those are played to test them.
+        """
+        k = self.kings[0 if self.white else 1]
+        if k < 0 or self.in_check():
+            return [mv for mv in self.generate() if self.safe(mv)]
+        b = self.board
+        pinned = self.pinned(k)
+        moves = []
+        for mv in self.generate():
+            s1 = mv & 127
+            if s1 == k or s1 in pinned or ((mv >> 7) & 127 == self.ep and b[s1] | 32 == PAWN):
+                if not self.safe(mv):
+                    continue
+            moves.append(mv)
+        return moves
+
+    def safe(self, mv):
+        """
+            Checks whether the pseudo-legal move mv leaves the king of the side to move out of check.
+        """
+        k = 0 if self.white else 1
+        undo = self.make(mv)
+        safe = not self.attacked(self.kings[k], self.white)
+        self.unmake(undo)
+        return safe
+
+    def pinned(self, k):
+        """
+            Returns the squares of the pieces of the side to move that shield their king on square k from
+            an attack of a bishop, rook or queen.
+        """
+        b = self.board
+        white = self.white
+        d = 32 if white else 0
+        pinned = set()
+        for steps, slider in ((BISHOP_STEPS, BISHOP), (ROOK_STEPS, ROOK)):
+            for step in steps:
+                shield = -1
+                t = k + step
+                while t & 0x88 == 0:
+                    p = b[t]
+                    if p != EMPTY:
+                        if (p >= 97) != white:
+                            if shield >= 0 and (p == slider - d or p == QUEEN - d):
+                                pinned.add(shield)
+                            break
+                        if shield >= 0:
+                            break
+                        shield = t
+                    t += step
+        return pinned
+
+    def make(self, mv):
+        """
+            Plays the integer move mv, without checking that it is legal.
+            Returns the information that unmake needs to take the move back.
+        """
+        b = self.board
+        s1 = mv & 127
+        s2 = (mv >> 7) & 127
+        p = b[s1]
+        captured = b[s2]
+        undo = (mv, captured, self.castling, self.ep, self.hash)
+        kind = p | 32
+        Z = ZOBRIST_PIECES
+
+        h = self.hash ^ Z[p][s1] ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_BLACK
+        if captured != EMPTY:
+            h ^= Z[captured][s2]
+        if self.ep >= 0:
+            h ^= ZOBRIST_EP[self.ep & 7]
+
+        b[s2] = p
+        b[s1] = EMPTY
+        self.ep = -1
+
+        if kind == PAWN:
+            if s2 == undo[3]:
+                # En passant capture
+                c = (s2 & 7) | (s1 & 0x70)
+                h ^= Z[b[c]][c]
+                b[c] = EMPTY
+            elif s2 - s1 == 32 or s1 - s2 == 32:
+                self.ep = (s1 + s2) >> 1
+                h ^= ZOBRIST_EP[s1 & 7]
+            elif mv >> 14:
+                b[s2] = (mv >> 14) - (0 if self.white else 32)
+        elif kind == KING:
+            self.kings[0 if self.white else 1] = s2
+            if s2 - s1 == 2:
+                r = b[s1 + 3]
+                b[s1 + 1] = r
+                b[s1 + 3] = EMPTY
+                h ^= Z[r][s1 + 3] ^ Z[r][s1 + 1]
+            elif s1 - s2 == 2:
+                r = b[s1 - 4]
+                b[s1 - 1] = r
+                b[s1 - 4] = EMPTY
+                h ^= Z[r][s1 - 4] ^ Z[r][s1 - 1]
+
+        self.castling &= CASTLE_MASK[s1] & CASTLE_MASK[s2]
+        self.white = not self.white
+        self.hash = h ^ Z[b[s2]][s2] ^ ZOBRIST_CASTLING[self.castling]
+        return undo
+
+    def unmake(self, undo):
+        """
+            Takes back a move played by make.
+        """
+        mv, captured, self.castling, self.ep, self.hash = undo
+        self.white = not self.white
+        b = self.board
+        s1 = mv & 127
+        s2 = (mv >> 7) & 127
+        p = b[s2]
+        kind = p | 32
+
+        if mv >> 14:
+            p = PAWN - (0 if self.white else 32)
+        b[s1] = p
+        b[s2] = captured
+
+        if kind == PAWN and s2 == self.ep:
+            b[(s2 & 7) | (s1 & 0x70)] = PAWN - (32 if self.white else 0)
+        elif kind == KING:
+            self.kings[0 if self.white else 1] = s1
+            if s2 - s1 == 2:
+                b[s1 + 3] = b[s1 + 1]
+                b[s1 + 1] = EMPTY
+            elif s1 - s2 == 2:
+                b[s1 - 4] = b[s1 - 1]
+                b[s1 - 1] = EMPTY
+        return
+
+    def parse_san(self, san):
+        """
+            Finds the legal move in standard algebraic notation (such as Nf3, exd5, O-O or e8=Q+).
+            Returns the move as an integer (see parse_move), or None if there is no such move.
+        """
+        san = san.rstrip("+#!?")
+        if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            k = self.kings[0 if self.white else 1]
+            target = k + 2 if len(san) == 3 else k - 2
+            for mv in self.legal():
+                if mv & 127 == k and (mv >> 7) & 127 == target:
+                    return mv
+            return None
+
+        promotion = 0
+        if "=" in san:
+            promotion = ord(san[-1].lower())
+            san = san[:san.index("=")]
+        elif len(san) > 2 and san[-1] in "QRBN" and san[-2].isdigit():
+            promotion = ord(san[-1].lower())
+            san = san[:-1]
+
+        kind = PAWN
+        if san and san[0] in "NBRQK":
+            kind = ord(san[0].lower())
+            san = san[1:]
+        san = san.replace("x", "").replace("-", "")
+        if len(san) < 2 or san[-2] not in "abcdefgh" or san[-1] not in "12345678":
+            return None
+        target = square(san, len(san) - 2)
+        hint = san[:-2]
+
+        for mv in self.legal():
+            s1 = mv & 127
+            if (mv >> 7) & 127 != target or self.board[s1] | 32 != kind or mv >> 14 != promotion:
+                continue
+            if any(NAMES[s1][0] != c for c in hint if c in "abcdefgh"):
+                continue
+            if any(NAMES[s1][1] != c for c in hint if c in "12345678"):
+                continue
+            return mv
+        return None
+
+    def pieces(self):
+        """
+            Returns the piece on every occupied square, by (x, y) coordinates (as the robot uses them).
+        """
+        return dict(((s & 7, s >> 4), chr(self.board[s])) for s in SQUARES if self.board[s] != EMPTY)
+
+    def occupancy(self):
+        """
+            Returns what a camera sees of the position: for every square 0 if it is empty, 1 for a white piece
+            and 2 for a black piece (as in classifier.py), ordered by column and then by row.
+        """
+        labels = []
+        for x in range(8):
+            for y in range(8):
+                p = self.board[x + 16*y]
+                labels.append(0 if p == EMPTY else 1 if p >= 97 else 2)
+        return labels
+
+    def footprint(self, mv):
+        """
+            Returns the set of squares whose occupation changes when mv is played.
+        """
+        s1 = mv & 127
+        s2 = (mv >> 7) & 127
+        kind = self.board[s1] | 32
+        squares = set([s1, s2])
+        if kind == KING and (s2 - s1 == 2 or s1 - s2 == 2):
+            r = s1 & 0x70
+            if s2 > s1:
+                squares.update([r + 7, r + 5])
+            else:
+                squares.update([r, r + 3])
+        elif kind == PAWN and s2 == self.ep:
+            squares.add((s2 & 7) | (s1 & 0x70))
+        return squares
 
 class Game:
-    
-    # Start the stockfish engine 
-    stockfish = subprocess.Popen(["/usr/games/stockfish"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    # ./stockfish_8_x64.exe    
+
+    # Connection to the stockfish engine, started on the first search
+    engine = None
+
+    # Pool of engines shared by several games, or None if every game starts its own engine
+    pool = None
+
+    # Opening book that is consulted before the engine, or None
+    book = None
 
     # Skill level (0,...,20)
     skill_level = 6
-    
+
     # Time that the computer can think.
     move_time = 2
 
+    # Time management of the engine (see clock.Clock), or None to think move_time seconds on every move
+    clock = None
+
     # Moves of the game
     moves = []
 
     # Current position at the board
-    position = {}
-    
+    position = Position()
+
+    # Hashes of all positions of the game, including the current one
+    history = []
+
+    # Best moves of the engine, by (hash, skill level, move time)
+    engine_cache = collections.OrderedDict()
+
+    # Whether a move needs a lift, by (hash, move)
+    lift_cache = collections.OrderedDict()
+
+    # Maximum number of entries of each cache
+    cache_size = 100000
+
+    # Score of a square (see Camera.changes) from which it counts as completely changed
+    change = 30
+
+    # How strongly the confidence of a move depends on the difference in fit with the other moves
+    sharpness = 3
+
+    # Confidence below which a move from the camera should not be trusted
+    confidence = 0.8
+
     def new_game(self):
         """
             Set up the initial position and clears the move list.
         """
         self.moves = []
-        self.position = { 
-            "a1" : "r", "b1" : "n", "c1" : "b", "d1" : "q", "e1" : "k", "f1" : "b", "g1" : "n", "h1" : "r", 
-            "a2" : "p", "b2" : "p", "c2" : "p", "d2" : "p", "e2" : "p", "f2" : "p", "g2" : "p", "h2" : "p", 
-            "a7" : "P", "b7" : "P", "c7" : "P", "d7" : "P", "e7" : "P", "f7" : "P", "g7" : "P", "h7" : "P", 
-            "a8" : "R", "b8" : "N", "c8" : "B", "d8" : "Q", "e8" : "K", "f8" : "B", "g8" : "N", "h8" : "R" 
-        }
-        
+        self.position = Position().setup()
+        self.history = [self.position.hash]
+        if self.clock is not None:
+            self.clock.new_game()
+
     def get_move(self,m):
         """
             Transform the move into a format understandable for the robot.
         """
-        s1 = m[:2]
-        s2 = m[2:4]
-        
-        p1 = self.position[s1]
-        x1,y1 = self.a2c(s1)
-        
-        p2 = ""
-        if self.position.has_key(s2):
-            p2 = self.position[s2]
-        x2,y2 = self.a2c(s2)
-        
+        s1 = square(m, 0)
+        s2 = square(m, 2)
+
+        p1 = self.position.piece(s1)
+        x1,y1 = s1 & 7, s1 >> 4
+
+        p2 = self.position.piece(s2)
+        x2,y2 = s2 & 7, s2 >> 4
+
         lift = self.need_lift(m)
         castle = self.is_castle(m)
         ep = self.is_enpassant(m)
-        
+
         return p1,x1,y1,p2,x2,y2,lift,castle,ep
 
     def is_castle(self,m):
         """
             Checks if the move is a castling move.
         """
-        s1 = m[:2]
-        s2 = m[2:4]
-        if s1 == "e1" and self.position.has_key("e1"):
-            if self.position["e1"] == "k" and (s2 == "c1" or s2 == "g1"):
-                return True  
-        
-        if s1 == "e8" and self.position.has_key("e8"):
-            if self.position["e8"] == "K" and (s2 == "c8" or s2 == "g8"):
-                return True
-
+        s1 = square(m, 0)
+        s2 = square(m, 2)
+        p = self.position[s1]
+        if s1 == 4 and p == ord("k"):
+            return s2 == 2 or s2 == 6
+        if s1 == 116 and p == ord("K"):
+            return s2 == 114 or s2 == 118
         return False
 
     def is_enpassant(self,m):
         """
             Checks if the move is an en passant capture
         """
-        s1 = m[:2]
-        s2 = m[2:4]
-        if self.position.has_key(s1) and not self.position.has_key(s2):
-            if self.position[s1].lower() == "p" and m[0] != m[2]:
-                return True
+        s1 = square(m, 0)
+        s2 = square(m, 2)
+        p = self.position[s1]
+        if (p == ord("p") or p == ord("P")) and self.position[s2] == EMPTY:
+            return (s1 & 7) != (s2 & 7)
         return False
-        
+
     def need_lift(self,m):
         """
             Determines whether the grabber must be lifted, such that the robot does not knock over other pieces.
-            
+
             :param string m: Simplified algebraic notation of the move (such as g1f3 for Ng1-f3 and e1g1 for 0-0).
         """
+        key = (self.position.hash, m)
+        if key in self.lift_cache:
+            return self.lift_cache[key]
+        return self.remember(self.lift_cache, key, self.find_lift(m))
+
+    def find_lift(self,m):
+        """
+            Checks the squares around the path of the move for obstacles (see need_lift).
+        """
+        s1 = square(m, 0)
+        s2 = square(m, 2)
+        board = self.position.board
 
         # Never lift a pawn
-        if self.position[m[:2]] == "p" or self.position[m[:2]] == "P":
+        if board[s1] == ord("p") or board[s1] == ord("P"):
             return False
 
-        x1,y1 = self.a2c(m[:2])
-        x2,y2 = self.a2c(m[2:4])
+        x1,y1 = s1 & 7, s1 >> 4
+        x2,y2 = s2 & 7, s2 >> 4
+        dx = (x2 > x1) - (x2 < x1)
+        dy = (y2 > y1) - (y2 < y1)
 
-        # If the move is vertical, check for obstacles.
-        if x1 == x2:
-            for t in range(1,y2-y1):
-                if self.position.has_key(self.c2a(x1,y1+t)):
-                    return True
+        # If the move is vertical or horizontal, check for obstacles.
+        d = dx + 16*dy
+        if d == 0:
             return False
-
-        # If the move is horizontal, check for obstacles.
-        if y1 == y2:
-            for t in range(1,x2-x1):
-                if self.position.has_key(self.c2a(x1+t,y1)):
+        if x1 == x2 or y1 == y2:
+            for s in range(s1 + d, s2, d):
+                if board[s] != EMPTY:
                     return True
             return False
 
         # If the move is diagonal, check for obstacles below, above, and on the diagonal.
-        if np.abs(x2-x1) == np.abs(y2-y1):
-            if self.position.has_key(self.c2a(x1+np.sign(x2-x1),y1)):
+        if abs(x2-x1) == abs(y2-y1):
+            if board[s1 + dx] != EMPTY or board[s1 + 16*dy] != EMPTY:
                 return True
-            if self.position.has_key(self.c2a(x1,y1+np.sign(y2-y1))):
-                return True
-            for t in range(1,np.abs(x2-x1)):
-                if self.position.has_key(self.c2a(x1+np.sign(x2-x1)*(t+1),y1+np.sign(y2-y1)*t)):
-                    return True
-                if self.position.has_key(self.c2a(x1+np.sign(x2-x1)*t,y1+np.sign(y2-y1)*(t+1))):
-                    return True
-                if self.position.has_key(self.c2a(x1+np.sign(x2-x1)*t,y1+np.sign(y2-y1)*t)):
+            for s in range(s1 + d, s2, d):
+                if board[s] != EMPTY or board[s + dx] != EMPTY or board[s + 16*dy] != EMPTY:
                     return True
             return False
 
         # By default, the piece must be lifted.
         return True
-        
+
     def move(self,m):
         """
             Executes a move.
-            
+
             :param string m: Simplified algebraic notation of the move (such as g1f3, e1g1 (0-0), d7d8q (promotion)).
         """
-        s0 = m[:2]
-        s1 = m[2:4]
-
-        castle = self.is_castle(m)
-        enpass = self.is_enpassant(m)
-
-        if self.position.has_key(s0):
-
-            # Get the piece
-            p = self.position[s0]
-            
-            # Update, if case of promotion
-            if len(m) == 5:
-                p = m[4]
-            
-            # Drop the piece
-            self.position[s1] = p
-            del self.position[s0]
-            
-            # For castling, move the rook
-            if castle:
-                if s1[0] == "c":
-                    self.position["d" + m[1]] = "r"
-                    del self.position["a" + m[1]]
-                else:
-                    self.position["f" + m[1]] = "r"
-                    del self.position["h" + m[1]]
-            
-            # En passant capture
-            if enpass:
-                del self.position[m[2]+m[1]]
-            
+        if not self.is_legal(m):
+            raise ValueError("Illegal move " + m)
+        self.position.make(parse_move(m))
         self.moves.append(m)
+        self.history.append(self.position.hash)
         return
-        
+
+    def repetitions(self):
+        """
+            Counts how often the current position occurred in the game, including now.
+        """
+        return self.history.count(self.position.hash)
+
+    def remember(self,cache,key,value):
+        """
+            Stores a value in one of the caches, and forgets the oldest entry if the cache is full.
+        """
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return value
+
+    def is_legal(self,m):
+        """
+            Checks if the move is legal in the current position.
+
+            :param string m: Simplified algebraic notation of the move.
+        """
+        if len(m) < 4 or len(m) > 5 or m[0] not in "abcdefgh" or m[2] not in "abcdefgh":
+            return False
+        if m[1] not in "12345678" or m[3] not in "12345678":
+            return False
+        return parse_move(m) in self.position.legal()
+
+    def legal_moves(self):
+        """
+            Lists all legal moves in the current position.
+        """
+        return [move_name(mv) for mv in self.position.legal()]
+
     def show(self):
         """
             Prints the current position and all moves to the console
@@ -174,81 +731,199 @@ class Game:
         for y in range(8):
             line = ""
             for x in range(8):
-                s = self.c2a(x,7-y)
-                if self.position.has_key(s):
-                    line += self.position[s]
-                else:
-                    line += "-"
+                p = self.position[x + 16*(7-y)]
+                line += chr(p) if p != EMPTY else "-"
             print(line)
         return
-        
-    def best_move(self):
+
+    @tracing.timed("game.best_move")
+    def best_move(self,watch=None):
         """
             Invokes Stockfish to calculate the best move in the current position.
-            
-            :param int move_time: Time that the engine is allowed to think in seconds.
-        """
-        move_string = ' '.join(self.moves)
-        
-        self.stockfish.stdin.write(('setoption name Skill Level value ' + str(self.skill_level) + '\n').encode('utf-8'))
-        self.stockfish.stdin.flush()
-        self.stockfish.stdin.write(('position startpos moves ' + move_string + '\n').encode('utf-8'))
-        self.stockfish.stdin.flush()
-        self.stockfish.stdin.write(('go movetime ' + str(1000 * self.move_time) + '\n').encode('utf-8'))
-        self.stockfish.stdin.flush()
-
-        while True:
-            line = self.stockfish.stdout.readline().decode().rstrip()
-            if "bestmove" in line:
-                return line.split()[1]
-        
+            If the engine was pondering on the move that was played, its answer comes back immediately.
+            Positions in the opening book are answered from the book, without the engine.
+
+            :param watch: Function that is called with every info line of the engine, and stops the search if it returns True.
+        """
+        if self.book is not None:
+            m = self.book.choose(self.position, self.skill_level)
+            if m is not None:
+                if self.engine is not None:
+                    self.engine.stop()
+                    self.engine.prediction = None
+                return m
+
+        # With a clock the thinking time differs from move to move, so the result is not reused. Neither is
+        # the move in a position that occurred before, because the engine avoids or seeks a repetition.
+        key = (self.position.hash, self.skill_level, self.move_time)
+        cached = self.clock is None and self.repetitions() < 2
+        if cached and key in self.engine_cache:
+            best, ponder = self.engine_cache[key]
+            if self.engine is not None:
+                self.engine.stop()
+                self.engine.predict(self.moves, best, ponder)
+            return best
+
+        engine = self.start_engine()
+        engine.set_option("Skill Level", self.skill_level)
+        if self.clock is None:
+            best, ponder = engine.search(self.moves, 1000 * self.move_time, watch)
+        else:
+            legal = self.position.legal()
+            target, limit = self.clock.allocate(self.position, len(legal))
+            if len(legal) == 1:
+                engine.stop()
+                engine.prediction = None
+                return move_name(legal[0])
+            check = self.clock.check
+            if watch is not None:
+                check = lambda line: watch(line) or self.clock.check(line)
+            self.clock.start()
+            best, ponder = engine.search(self.moves, 1000 * limit, check)
+            self.clock.stop()
+            return best
+        if cached:
+            self.remember(self.engine_cache, key, (best, ponder))
+        return best
+
+    def ponder(self):
+        """
+            Lets the engine think on the expected reply of the opponent, during the opponent's turn.
+            Call this after the move of the engine has been played.
+        """
+        if self.engine is None:
+            return False
+        move_time = self.move_time
+        prediction = self.engine.prediction
+        if self.clock is not None and prediction is not None and prediction[0] == self.moves:
+            # Think as long as the clock allows in the position after the expected reply.
+            position = self.position.copy()
+            position.make(parse_move(prediction[1]))
+            target, limit = self.clock.allocate(position)
+            if limit > 0:
+                move_time = limit
+        return self.engine.ponder(self.moves, 1000 * move_time)
+
+    def start_engine(self):
+        """
+            Returns the engine of this game, and starts it if necessary.
+        """
+        if self.engine is None:
+            if self.pool is not None:
+                self.engine = self.pool.acquire()
+            else:
+                self.engine = uci.Engine()
+        return self.engine.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.exit()
+        return False
+
+    def exit(self):
+        """
+            Terminates the engine, or returns it to the pool.
+        """
+        if self.engine is not None:
+            if self.pool is not None:
+                self.pool.release(self.engine)
+            else:
+                self.engine.quit()
+            self.engine = None
         return
-                
+
+    @tracing.timed("game.find_move")
     def find_move(self,squares):
         """
-            Find the move from a list of squares that changed.
+            Find the move from a list of squares that changed (see infer_move).
+            Returns None if there are no legal moves.
         """
-        sqrs = [self.c2a(x,y) for (x,y) in squares]
-        if set(sqrs) == set(["e1","f1","g1","h1"]):
-            return "e1g1"
-        if set(sqrs) == set(["a1","c1","d1","e1"]):
-            return "e1c1"
-        if set(sqrs) == set(["e8","f8","g8","h8"]):
-            return "e8g8"
-        if set(sqrs) == set(["a8","c8","d8","e8"]):
-            return "e8c8"
-
-        s1 = "a1"
-        s2 = "a1"
+        scores = [[0]*8 for x in range(8)]
         for (x,y) in squares:
-            s = self.c2a(x,y)
-            if self.position.has_key(s):
-                if (len(self.moves) % 2 == 0) == self.position[s].islower():
-                    s1 = s
-                else:
-                    s2 = s
-            else:
-                s2 = s
-        return s1 + s2
-                
+            scores[x][y] = self.change
+        return self.infer_move(scores)[0]
+
+    def infer_move(self,scores):
+        """
+            Infers the move that was played from the change scores of the squares.
+            Every legal move is compared with the squares it changes (including the rook for castling,
+            and the captured pawn for en passant). A square that changes counts in favour of the moves that
+            change it, and against the others. Promotions are assumed to be to a queen.
+            Returns the best move and its confidence (0,...,1), or (None, 0) if there are no legal moves.
+
+            :param scores: Change score of every square, indexed by column x and row y (see Camera.changes).
+        """
+        # Evidence of every square, from -1 (unchanged) to 1 (changed)
+        evidence = [0] * 128
+        for x in range(8):
+            for y in range(8):
+                evidence[x + 16*y] = 2 * min(scores[x][y] / self.change, 1) - 1
+
+        fits = []
+        for mv in self.position.legal():
+            if mv >> 14 not in (0, QUEEN):
+                continue
+            fits.append((sum(evidence[s] for s in self.position.footprint(mv)), mv))
+        if not fits:
+            return None, 0
+
+        # Confidence of the best move, as its share in the exponentially weighted fits
+        best, mv = max(fits)
+        total = sum(math.exp(self.sharpness * (fit - best)) for fit, other in fits)
+        return move_name(mv), 1 / total
+
+    def resync(self,labels):
+        """
+            Compares the position with the pieces that the camera sees on the board (see classifier.py).
+            If they differ, it looks for one or two legal moves that explain the difference, and plays them.
+            Returns the moves that were played, or None if the board cannot be explained.
+
+            :param labels: Label of every square, indexed by column x and row y.
+        """
+        observed = [int(labels[x][y]) for x in range(8) for y in range(8)]
+        if self.position.occupancy() == observed:
+            return []
+        position = self.position.copy()
+        for mv in position.legal():
+            if mv >> 14 not in (0, QUEEN):
+                continue
+            undo = position.make(mv)
+            if position.occupancy() == observed:
+                self.move(move_name(mv))
+                return [move_name(mv)]
+            for reply in position.legal():
+                if reply >> 14 not in (0, QUEEN):
+                    continue
+                u = position.make(reply)
+                found = position.occupancy() == observed
+                position.unmake(u)
+                if found:
+                    self.move(move_name(mv))
+                    self.move(move_name(reply))
+                    return [move_name(mv), move_name(reply)]
+            position.unmake(undo)
+        return None
+
     def a2c(self,s):
         """
             From algebraic notation to cartesian coordinates.
             If the string is invalid, it returns (0,0).
-            
-            :param string S: square (such as a1, h8). 
+
+            :param string S: square (such as a1, h8).
         """
         x,y = (0,0)
         if len(s) == 2:
-            x = np.max([np.min([ord(s[0])-97,7]),0])
-            y = np.max([np.min([int(s[1])-1,7]),0])
+            x = max(min(ord(s[0])-97,7),0)
+            y = max(min(int(s[1])-1,7),0)
         return (x,y)
-    
+
     def c2a(self,x,y):
         """
             From cartesian coordinates to algebraic notation.
-            
+
             :param int x: Column 0=a, 7=h.
             :param int y: Row 0=1, 7=8.
         """
-        return chr(x + 97) + str(y+1)
+        return NAMES[x + 16*y]
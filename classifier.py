@@ -0,0 +1,60 @@
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+# Labels of the squares
+EMPTY, WHITE, BLACK = 0, 1, 2
+
+class Classifier:
+    """
+        Labels every square of a warped 400x400 gray scale picture as empty, white piece or black piece.
+        Each square is described by the mean and the standard deviation of its inner part, and gets the label
+        of the nearest class. The classes are learned from a picture of the initial position, separately for
+        light and dark squares.
+    """
+
+    # Pixels to ignore at the edge of every square
+    margin = 10
+
+    def __init__(self):
+        self.centers = None
+        self.scale = None
+
+        # Light (1) or dark (0) square, indexed by column x and row y
+        x, y = np.indices((8,8))
+        self.parity = (x + y) % 2
+
+    def features(self, img):
+        """
+            Computes the mean and standard deviation of every square in one pass.
+            Returns an 8x8x2 array, indexed by column x and row y.
+        """
+        m = self.margin
+        blocks = img.reshape(8,50,8,50)[:,m:50-m,:,m:50-m].astype(np.float32)
+        mean = blocks.mean(axis=(1,3)).T
+        std = blocks.std(axis=(1,3)).T
+        return np.stack([mean, std], axis=-1)
+
+    def learn(self, img):
+        """
+            Learns the classes from a picture of the initial position.
+        """
+        f = self.features(img)
+        labels = np.full((8,8), EMPTY)
+        labels[:,0:2] = WHITE
+        labels[:,6:8] = BLACK
+        self.centers = np.zeros((3,2,2), np.float32)
+        for label in (EMPTY, WHITE, BLACK):
+            for parity in (0, 1):
+                self.centers[label, parity] = f[(labels == label) & (self.parity == parity)].mean(axis=0)
+        self.scale = np.maximum(f.reshape(64,2).std(axis=0), 1)
+        return
+
+    def classify(self, img):
+        """
+            Returns the label of every square as an 8x8 array, indexed by column x and row y.
+        """
+        f = self.features(img)
+        d = (((f[np.newaxis] - self.centers[:, self.parity]) / self.scale) ** 2).sum(axis=-1)
+        return d.argmin(axis=0)
@@ -0,0 +1,134 @@
+from __future__ import print_function
+from __future__ import division
+
+import time
+
+import uci
+import chess
+
+# Material of the pieces that define the game phase
+MATERIAL = {chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9}
+
+class Clock:
+    """
+        Divides a time budget for the whole game over the moves of the engine.
+        Every search gets a target time that depends on the game phase and the number of legal moves,
+        and a hard limit. While the engine searches, its info lines decide whether the best move is
+        stable enough to stop before the target, or unstable enough to continue until the limit.
+    """
+
+    # Thinking time of the engine for the whole game (seconds)
+    budget = 80
+
+    # Bounds on the target time of a single move (seconds)
+    minimum = 0.05
+    maximum = 10
+
+    # Depth that the engine must reach before it may stop early
+    depth = 8
+
+    # Change of the score between two depths (centipawns) that makes the engine think until the limit
+    swing = 50
+
+    def __init__(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.new_game()
+
+    def new_game(self):
+        """
+            Restores the full budget.
+        """
+        self.used = 0
+        self.target = 0
+        self.limit = 0
+        self.started = time.time()
+        self.history = []
+        return
+
+    def remaining(self):
+        return max(self.budget - self.used, 0)
+
+    def phase(self, position):
+        """
+            Returns the non-pawn material on the board, from 1 in the opening to 0 in a pawn ending.
+        """
+        material = 0
+        for s in chess.SQUARES:
+            material += MATERIAL.get(position[s] | 32, 0)
+        return min(material / 62, 1)
+
+    def allocate(self, position, legal=None):
+        """
+            Computes the target time and the hard limit in seconds for a search in the position.
+            Both are 0 if there is only one legal move.
+        """
+        if legal is None:
+            legal = len(position.legal())
+        if legal <= 1:
+            self.target, self.limit = 0, 0
+            return 0, 0
+
+        # Expect more moves to come in the opening than in the endgame.
+        moves_to_go = 15 + 25 * self.phase(position)
+        target = self.remaining() / moves_to_go
+
+        # Think less if there are only a few moves to choose from.
+        if legal <= 5:
+            target *= 0.5
+
+        target = min(max(target, self.minimum), self.maximum)
+        limit = max(min(3 * target, self.remaining() / 4, self.maximum), target)
+        self.target, self.limit = target, limit
+        return target, limit
+
+    def start(self):
+        """
+            Starts timing a search with the last allocated target and limit.
+        """
+        self.started = time.time()
+        self.history = []
+        return
+
+    def check(self, line):
+        """
+            Reads an info line of the engine, and decides whether the search can stop.
+        """
+        info = uci.parse_info(line)
+        if info["score"] is None or not info["pv"]:
+            return False
+        if self.history and self.history[-1][0] == info["depth"]:
+            self.history[-1] = (info["depth"], info["pv"][0], info["score"])
+        else:
+            self.history.append((info["depth"], info["pv"][0], info["score"]))
+
+        elapsed = time.time() - self.started
+        if elapsed >= self.limit:
+            return True
+
+        # Stop at once when a mate has been found.
+        kind, score = info["score"]
+        if kind == "mate" and score > 0:
+            return True
+
+        # Continue until the limit while the score swings.
+        if len(self.history) >= 2:
+            previous = self.history[-2][2]
+            if kind == "cp" and previous[0] == "cp" and abs(score - previous[1]) > self.swing:
+                return False
+
+        # The longer the best move stays the same, the earlier the search stops.
+        stable = 1
+        while stable < len(self.history) and self.history[-stable-1][1] == self.history[-1][1]:
+            stable += 1
+        if info["depth"] < self.depth:
+            stable = 1
+        return elapsed >= self.target / stable ** 1.5
+
+    def stop(self):
+        """
+            Charges the time of the search to the budget, and returns it.
+        """
+        elapsed = time.time() - self.started
+        self.used += elapsed
+        return elapsed
@@ -0,0 +1,131 @@
+from __future__ import print_function
+from __future__ import division
+
+import threading
+
+import uci
+import chess
+
+class Controller:
+    """
+        Plays the moves of the robot, overlapping the search of the engine, the motion of the gantry and the
+        pictures of the camera. A worker thread drives the robot: while the engine thinks, the gantry travels
+        to the square where the move it currently prefers starts, and after the move the camera takes the
+        next reference picture as soon as the gantry has left the board. Meanwhile the main thread is free to
+        update the board and to let the engine ponder.
+    """
+
+    # Depth that the engine must reach before the gantry follows its preferred move
+    depth = 4
+
+    # Recorder that receives the output of the engine (see recorder.py), or None
+    recorder = None
+
+    def __init__(self, game, robot, camera=None):
+        self.game = game
+        self.robot = robot
+        self.camera = camera
+
+        # Square that the gantry should travel to, and the move that it should perform
+        self.target = None
+        self.job = None
+        self.guess = None
+
+        self.submitted = 0
+        self.finished = 0
+        self.error = None
+        self.running = True
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.running and self.job is None and self.target is None:
+                    self.lock.wait()
+                if self.job is None and not self.running:
+                    return
+
+                # A move replaces any travel that is still waiting.
+                job, target = self.job, self.target
+                self.job, self.target = None, None
+            try:
+                if job is not None:
+                    job()
+                else:
+                    self.robot.goto(*target)
+            except Exception as error:
+                with self.lock:
+                    self.error = error
+            if job is not None:
+                with self.lock:
+                    self.finished += 1
+                    self.lock.notify_all()
+
+    def watch(self, line):
+        """
+            Reads an info line of the engine, and sends the gantry to the first square of the preferred move.
+        """
+        if self.recorder is not None:
+            self.recorder.watch(line)
+        info = uci.parse_info(line)
+        if not info["pv"] or info["depth"] < self.depth:
+            return False
+        m = info["pv"][0]
+        s1, s2 = chess.square(m, 0), chess.square(m, 2)
+
+        # The robot removes a captured piece first.
+        s = s2 if self.game.position[s2] != chess.EMPTY else s1
+        if s != self.guess:
+            self.guess = s
+            with self.lock:
+                self.target = (s & 7, s >> 4)
+                self.lock.notify_all()
+        return False
+
+    def play(self):
+        """
+            Lets the engine choose a move, and starts performing it on the board. Returns the move at once,
+            before the robot has finished it (see wait).
+        """
+        self.guess = None
+        m = self.game.best_move(self.watch)
+        args = self.game.get_move(m) + (m[4:],)
+
+        def job():
+            self.robot.move(*args)
+            if self.camera is not None:
+                targets, t = self.robot.clear()
+                self.camera.picture()
+                self.robot.wait(targets, t + self.robot.slack)
+
+        with self.lock:
+            self.target = None
+            self.job = job
+            self.submitted += 1
+            self.lock.notify_all()
+        return m
+
+    def wait(self):
+        """
+            Waits until the robot has performed the last move, and raises the error of the robot if any.
+        """
+        with self.lock:
+            while self.finished < self.submitted:
+                self.lock.wait()
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return
+
+    def close(self):
+        """
+            Finishes the last move, and stops the worker thread.
+        """
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.thread.join()
+        return
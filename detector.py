@@ -0,0 +1,78 @@
+from __future__ import print_function
+from __future__ import division
+
+import cv2
+import time
+import tracing
+
+class MoveDetector:
+    """
+        Watches the board to detect when the user completed a move: a hand enters the board, leaves it
+        again, and the board stays still for a moment. The still board is then compared with the last
+        picture of the camera.
+    """
+
+    # Mean absolute difference (gray levels) between two frames that counts as motion
+    motion = 3
+
+    # Time without motion after which the board is considered still (seconds)
+    settle = 0.4
+
+    # Side of the downscaled image that is used to measure motion (pixels)
+    size = 100
+
+    # Maximal number of squares that a move changes (castling); more means that a hand is still in view
+    squares = 4
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.energy = 0
+        self.moving = False
+
+    def small(self, img):
+        return cv2.resize(img, (self.size, self.size), interpolation=cv2.INTER_AREA)
+
+    @tracing.timed("detector.wait")
+    def wait(self, timeout=None):
+        """
+            Blocks until the user completed a move, and appends the still picture to the list of the camera.
+            Returns the squares that changed and their scores (see Camera.changes).
+
+            :param float timeout: Seconds to wait at most, or None to wait as long as necessary.
+        """
+        if not self.camera.L:
+            raise ValueError("No picture to compare with. Take a picture first.")
+        session = self.camera.start()
+        deadline = None if timeout is None else time.time() + timeout
+        previous = None
+        quiet = None
+        self.moving = False
+        while True:
+            img = self.camera.process(session.frame())
+            small = self.small(img)
+            now = time.time()
+
+            if previous is not None:
+                # Motion energy between consecutive frames
+                self.energy = cv2.absdiff(small, previous).mean()
+                if self.energy > self.motion:
+                    self.moving = True
+                    quiet = None
+                elif self.moving:
+                    if quiet is None:
+                        quiet = now
+                    elif now - quiet >= self.settle:
+                        # The board is still: compare with the last picture.
+                        quiet = None
+                        squares, scores = self.camera.compare(self.camera.L[-1], img)
+                        if 0 < len(squares) <= self.squares:
+                            self.moving = False
+                            self.camera.add(img)
+                            return squares, scores
+
+                        # Wait for the hand to leave, or for the next move if nothing changed.
+                        self.moving = len(squares) > 0
+            previous = small
+
+            if deadline is not None and now >= deadline:
+                raise IOError("No move within " + str(timeout) + "s")
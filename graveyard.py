@@ -0,0 +1,59 @@
+from __future__ import print_function
+from __future__ import division
+
+class Graveyard:
+    """
+        Keeps track of the captured pieces on the squares around the board, and chooses the squares to
+        put them on and to take them back from.
+    """
+
+    def __init__(self, slots=None):
+        """
+            :param list slots: (x, y) squares that can hold a captured piece. By default the rows in front
+                of and behind the board, and the columns to its left and right.
+        """
+        if slots is None:
+            slots = [(x, y) for y in (-1, 8) for x in range(8)] + [(x, y) for x in (-1, 8) for y in range(8)]
+        self.slots = slots
+
+        # Piece on every occupied slot
+        self.pieces = {}
+
+    def free(self):
+        """
+            Returns the slots without a piece.
+        """
+        return [s for s in self.slots if s not in self.pieces]
+
+    def allocate(self, cost):
+        """
+            Returns the free slot with the lowest cost, or None if every slot is taken.
+
+            :param cost: Function that maps a slot to the cost of using it (such as the travel time).
+        """
+        free = self.free()
+        if not free:
+            return None
+        return min(free, key=cost)
+
+    def find(self, p, cost):
+        """
+            Returns the slot with piece p with the lowest cost, or None if there is no such piece.
+        """
+        slots = [s for s, q in self.pieces.items() if q == p]
+        if not slots:
+            return None
+        return min(slots, key=cost)
+
+    def put(self, slot, p):
+        if slot in self.pieces:
+            raise ValueError("Slot " + str(slot) + " already holds " + self.pieces[slot])
+        self.pieces[slot] = p
+        return
+
+    def take(self, slot):
+        return self.pieces.pop(slot)
+
+    def clear(self):
+        self.pieces = {}
+        return
@@ -1,59 +1,108 @@
 import sys
+import time
+import archive
+import book
 import chess
+import clock
 import robot
+import startup
+import tracing
+import recorder
+import controller
 import camera
+import detector
+import classifier
+
+# Record how long the phases of every turn take.
+name = time.strftime("game-%Y%m%d-%H%M%S")
+tracing.tracer = tracing.Tracer(name + ".trace")
 
 G = chess.Game()
-R = robot.Robot()
 C = camera.Camera()          
 
+# Start the robot and the engine at the same time (add C.start to let the camera settle as well).
+R, E = startup.warm_up(robot.Robot, G.start_engine)
+C.archive = archive.Archive(name + ".arc")
+D = detector.MoveDetector(C)
+K = classifier.Classifier()
+T = controller.Controller(G, R)
+S = recorder.Recorder(C.archive)
+T.recorder = S
+#T.camera = C
+
 try:
     G.skill_level = int(raw_input("Welk niveau wil je spelen [0..20]? "))
+    G.book = book.Book()
+    G.clock = clock.Clock()
     G.new_game()
     
     while True:
 
         print("Even wachten aub...")
+        tracing.tracer.next()
+
+        # Wait until the robot finished its move, and record what the motors did.
+        T.wait()
+        S.commands(R.BP)
 
         # Take a picture.
         #C.picture()
 
-        #Improve: detect when the user completed a move.
+        # Check the internal board against the pieces on the board, and catch up on missed moves.
+        #if len(G.moves) == 0:
+        #    K.learn(C.L[-1])
+        #if G.resync(K.classify(C.L[-1])) is None:
+        #    print("Het bord klopt niet met " + ' '.join(G.moves))
+
+        # Wait until the user completed a move, and get all squares that changed since the previous picture.
+        #print("Speel een zet.")
+        #squares, scores = D.wait()
         raw_input("Speel een zet en geef enter.")
         
-        # Take a picture
-        #C.picture()
-        
-        # Get all squares that changed since the previous move.
-        #squares = C.changes()
-        
-        # Use the current position to determine what move is played.
-        #m1 = G.find_move(squares)
+        # Use the current position to determine what move is played, and take a new picture if unsure.
+        #m1, confidence = G.infer_move(scores)
+        #while confidence < G.confidence:
+        #    C.L.pop()
+        #    C.picture()
+        #    squares, scores = C.changes()
+        #    m1, confidence = G.infer_move(scores)
         m1 = "a2a3"
 	a = raw_input("Heb je " + m1 +" gespeeld?")
         if a != "":
             m1 = a
+        while not G.is_legal(m1):
+            m1 = raw_input(m1 + " is geen geldige zet. Welke zet heb je gespeeld? ")
         print("> " + m1)
+        S.human(m1)
                    
         # Execute the move on the internal board.
         G.move(m1)
 
-        # Let the engine calculate the best move.
-        m2 = G.best_move()
-               
-        # Perform the move at the chess board.
-        p1,x1,y1,p2,x2,y2,lift,castle,ep = G.get_move(m2)
+        # Let the engine calculate the best move, while the gantry travels to the piece it will likely move,
+        # and start performing the move at the chess board.
+        m2 = T.play()
         print("< " + m2)
-        R.move(p1,x1,y1,p2,x2,y2,lift,castle,ep)
-        #raw_input("please execute " + m2 + " : " + str(G.get_move(m2)))        
+        S.robot(m2)
 
-        # Update the internal board.
+        # Update the internal board, while the robot moves.
         G.move(m2)
 
         G.show()
 
+        # Let the engine think on the expected reply during the user's turn.
+        G.ponder()
+
         C.s = False
 
 except KeyboardInterrupt:
+    pass
+finally:
+    # Also release the engine, the motors and the archive when the robot fails.
+    T.close()
+    G.exit()
     R.exit()
+    C.close()
     C.save("p")
+    tracing.tracer.report()
+    tracing.tracer.chrome(name + ".json")
+    tracing.tracer.close()
@@ -0,0 +1,117 @@
+from __future__ import print_function
+from __future__ import division
+
+import time
+import argparse
+
+import chess
+import robot
+import camera
+import archive
+import backend
+
+class Recorder:
+    """
+        Records a game into an archive (see archive.py), next to the pictures of the camera: for every
+        move of the human the squares that changed and the move that was inferred from them, and for every
+        move of the robot the output of the engine and the commands that the motors received.
+        A recorded game can be played back without hardware (see replay).
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.lines = []
+
+    def watch(self, line):
+        """
+            Collects an info line of the engine (see Game.best_move).
+        """
+        self.lines.append(line)
+        return False
+
+    def human(self, move, squares=None, inferred=None, confidence=None):
+        """
+            Records a move of the human, with the squares that changed and the move inferred from them.
+        """
+        meta = {"player": "human", "move": move}
+        if squares is not None:
+            meta["squares"] = [[int(x), int(y)] for x, y in squares]
+        if inferred is not None:
+            meta["inferred"] = inferred
+            meta["confidence"] = confidence
+        self.archive.note(meta)
+        self.lines = []
+        return
+
+    def robot(self, move):
+        """
+            Records a move of the robot, with the info lines of the engine since the last move.
+        """
+        self.archive.note({"player": "robot", "move": move, "engine": self.lines})
+        self.lines = []
+        return
+
+    def commands(self, BP):
+        """
+            Records the commands that the motors received since the last call (see backend.py), and empties
+            the log of the motors such that it does not grow during the game.
+        """
+        log = BP.log[:]
+        del BP.log[:len(log)]
+        self.archive.note({"commands": [list(command) for command in log]})
+        return
+
+def replay(path, motors=True):
+    """
+        Plays a recorded game back at full speed: the frames go through Camera.changes and Game.find_move,
+        and the moves of the robot through a Robot on simulated motors.
+        Returns the number of moves, the moves of the human that were inferred differently, the time of the
+        replay and the simulated time of the robot.
+
+        :param bool motors: Whether to perform the moves of the robot.
+    """
+    G = chess.Game()
+    G.new_game()
+    C = camera.Camera()
+    C.s = False
+    BP = backend.Simulator(stops={backend.Simulator.PORT_D: (-30, 30)})
+    R = robot.Robot(BP) if motors else None
+
+    moves = 0
+    mismatches = []
+    fresh = False
+    start = time.time()
+    for kind, n, data in archive.read(path):
+        if kind == b"F":
+            C.L.append(data)
+            fresh = True
+            continue
+        if "move" not in data:
+            continue
+        m = data["move"]
+
+        if data.get("player") == "human" and fresh and len(C.L) >= 2:
+            squares, scores = C.changes()
+            inferred = G.find_move(squares)
+            if inferred != m:
+                mismatches.append((moves, m, inferred, squares))
+        elif data.get("player") == "robot" and R is not None:
+            R.move(*(G.get_move(m) + (m[4:],)))
+
+        if not G.is_legal(m):
+            raise ValueError("Illegal move " + m + " in " + path)
+        G.move(m)
+        moves += 1
+        fresh = False
+    return moves, mismatches, time.time() - start, BP.time()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays recorded games back without hardware.")
+    parser.add_argument("sessions", nargs="+", help="archives of games")
+    parser.add_argument("-n", "--no-robot", action="store_true", help="skip the moves of the robot")
+    args = parser.parse_args()
+    for path in args.sessions:
+        moves, mismatches, wall, simulated = replay(path, not args.no_robot)
+        print(path + ": " + str(moves) + " moves in " + "%.3f" % wall + "s, robot " + "%.1f" % simulated + "s")
+        for k, m, inferred, squares in mismatches:
+            print("  move " + str(k+1) + ": " + m + " inferred as " + str(inferred) + " from " + str(squares))
@@ -1,56 +1,78 @@
 from __future__ import print_function 
 from __future__ import division
 
-import sys
-import time
-import brickpi3
+import backend
+import graveyard
+import tracing
+import trajectory
 import numpy as np
 
 class Robot:
 
-    # Create a BrickPi3 object.
-    BP = brickpi3.BrickPi3() 
-    
-    # Ports of motors.
-    X = BP.PORT_B
-    Y = BP.PORT_A
-    Z = BP.PORT_C
-    H = BP.PORT_D
-
     px = 100   # power limit for columns
     sx = 500   # speed limit for columns (degree/second)
+    ax = 2000  # acceleration for columns, not measured yet (degree/second^2, see measure)
     dx = -710  # degrees to move 1 column right
 
     py = 100   # power for rows
     sy = 500   # speed for rows (degree/second)
+    ay = 2000  # acceleration for rows, not measured yet (degree/second^2, see measure)
     dy = 710   # degrees to move 1 row up
 
-    tsq = 1.1  # time to move over a single square (seconds)
-
     pz = 100   # power limit for lifting
     sz = 800   # speed limit for lifting (degree/second)
     dz = -900  # angle to lift the piece (degrees)
     hRNB = 50  # extra height of the grabber for rook, knight, and bishop
     hKQ = 100  # extra height of the grabber for king, and queen
+    hc = 600   # extra height at which a lifted piece clears all other pieces, not measured yet (degrees)
     
     pu = 60    # power for closing the grabber
     tu = 0.2   # time to close the grabber
     du = 0.01  # less time to open grabber
 
+    tol = 10   # distance to the target at which a motor has arrived (degrees)
+    dt = 0.01  # time between two readings of the encoders (seconds)
+    ts = 0.25  # time without progress after which a motor has stalled (seconds)
+    th = 0.05  # time without progress after which the grabber is fully open or closed (seconds)
+    tm = 0.1   # time that the grabber runs at least, before it can be fully open or closed (seconds)
+    slack = 1  # extra time before a motion times out (seconds)
+
     # initial position
     x0, y0 = (1, 8)
 
     # current position
     xc, yc = (x0, y0)
+
+    park = False  # return to the initial position after every move
+    every = 10    # number of moves after which the motors are reset (0 for never)
+    drift = 30    # difference between encoder and position at which the gantry is moved back (degrees)
+    count = 0     # number of moves since the last reset
     
-    def __init__(self):
+    def __init__(self, BP=None):
         """
             Initializes the robot.
+
+            :param BP: Motors (see backend.py), by default those of the BrickPi3.
         """
+        self.BP = BP if BP is not None else backend.BrickPi()
+
+        # Ports of motors.
+        self.X = self.BP.PORT_B
+        self.Y = self.BP.PORT_A
+        self.Z = self.BP.PORT_C
+        self.H = self.BP.PORT_D
+
         if self.BP.get_voltage_battery() < 7:
-            print("Battery voltage is too low (" + str(self.BP.get_voltage_battery())  + "V). Exiting.")
             self.BP.reset_all()
-            sys.exit()
+            raise IOError("Battery voltage is too low (" + str(self.BP.get_voltage_battery())  + "V).")
+
+        # captured pieces next to the board
+        self.graveyard = graveyard.Graveyard()
+
+        # velocity profiles of the gantry, and the moves that follow them
+        self.profiles = {self.X: trajectory.Profile(self.sx, self.ax), self.Y: trajectory.Profile(self.sy, self.ay)}
+        self.power = {self.X: self.px, self.Y: self.py}
+        self.motions = {}
 
         self.reset()
         return
@@ -60,6 +82,8 @@ class Robot:
             Resets the robot to its initial configuration
         """
         self.BP.reset_all()
+        self.count = 0
+        self.motions = {}
 
         # resets the encoder of the motors and sets the motor limits.
         self.BP.set_motor_limits(self.X, self.px, self.sx)
@@ -73,6 +97,13 @@ class Robot:
             print(error)
         return
     
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.exit()
+        return False
+
     def exit(self):
         """
             Terminates the robot.
@@ -80,7 +111,8 @@ class Robot:
         self.BP.reset_all()
         return
     
-    def move(self,p1,x1,y1,p2,x2,y2,lift,castle,ep):
+    @tracing.timed("robot.move")
+    def move(self,p1,x1,y1,p2,x2,y2,lift,castle,ep,promote=""):
         """
             Performs a move on the chess board.
             p1 is the piece at source location
@@ -90,14 +122,27 @@ class Robot:
             lift is true, if the piece must be lifted
             castle is true, if the rook must be moved
             ep is true, for en passant capture
+            promote is the piece that a pawn promotes to (such as "q"), or the empty string
         """
         
         # In case of a capture, first take the captured piece and put it on the side of the board.
         if p2 != "":
-            self.remove(p2,x2,y2)
-            
-        # Move the piece from (x1,x2) to (y1,y2)
-        self.transport(p1,x1,y1,x2,y2,lift)
+            self.remove(p2,x2,y2,(x1,y1))
+
+        # In case of a promotion, exchange the pawn for a captured piece.
+        slot = None
+        if promote != "":
+            q = promote.upper() if p1.isupper() else promote.lower()
+            slot = self.graveyard.find(q, lambda s: self.duration([s,(x2,y2)], (x1,y1)))
+            if slot is None:
+                print("No " + q + " next to the board. Please exchange the pawn yourself.")
+
+        if slot is not None:
+            self.remove(p1,x1,y1,slot)
+            self.fetch(q,x2,y2,slot)
+        else:
+            # Move the piece from (x1,x2) to (y1,y2)
+            self.transport(p1,x1,y1,x2,y2,lift)
 
         # If move is a castling move, move the rook.
         if castle == True:
@@ -108,35 +153,168 @@ class Robot:
                 xr2 = 5
             self.transport("r",xr1,y2,xr2,y2,True)
         
-        # If move is en passant, capture the pawn.
+        # If move is en passant, capture the pawn of the other colour.
         if ep == True:
-            self.remove("p",x2,y1)
+            self.remove("P" if p1.islower() else "p",x2,y1)
 
-        # Go to initial position and reset the motors.
-        self.goto(self.x0,self.y0)
-        time.sleep(0.2)
-        self.reset()
+        # Stay where we are, such that the next move starts from here, unless we must park.
+        if self.park:
+            self.goto(self.x0,self.y0)
+
+        # Move the gantry back to where it should be, if it drifted away.
+        if self.drifted():
+            self.correct()
+
+        # Reset the motors now and then.
+        self.count += 1
+        if self.every > 0 and self.count >= self.every:
+            self.wait({self.Z: 0}, np.abs(self.dz/self.sz) + self.slack)
+            self.BP.sleep(0.2)
+            self.reset()
+        return
+
+    def drifted(self):
+        """
+            Checks whether the encoders of the gantry disagree with its current position.
+        """
+        try:
+            ex = self.BP.get_motor_encoder(self.X) - self.xc*self.dx
+            ey = self.BP.get_motor_encoder(self.Y) - self.yc*self.dy
+        except IOError as error:
+            print(error)
+            return True
+        return np.abs(ex) > self.drift or np.abs(ey) > self.drift
+
+    def correct(self):
+        """
+            Moves the gantry back to the current position, such that the encoders agree with it again.
+        """
+        targets = {self.X: self.xc*self.dx, self.Y: self.yc*self.dy}
+        t = 0
+        for port, target in targets.items():
+            profile = self.profiles[port]
+            t = max(t, profile.duration(target - self.BP.get_motor_encoder(port)))
+            self.motions.pop(port, None)
+            self.BP.set_motor_limits(port, self.power[port], profile.speed)
+            self.BP.set_motor_position(port, target)
+        self.wait(targets, t + self.slack)
         return
         
+    @tracing.timed("robot.transport")
     def transport(self,p,x1,y1,x2,y2,up):
         """
             Transports a piece p from (x1,y1) to (x2,y2) 
         """
-        self.goto(x1,y1)
-        self.down(p)
-        self.close()
-        if up == True:
-            self.up(p)
-        self.goto(x2,y2)
+        self.run(self.schedule(p,x1,y1,x2,y2,up), self.clearance(p))
+        return
+
+    def schedule(self,p,x1,y1,x2,y2,up):
+        """
+            Plans the transport of a piece p from (x1,y1) to (x2,y2) as a timeline of steps.
+            Every step (xy, z, grabber, wait) starts moving the gantry to square xy and the grabber to height z
+            (unless they are None), then closes or opens the grabber (if grabber is "close" or "open"),
+            and finally waits until the gantry arrived ("xy" in wait), the grabber arrived ("z" in wait),
+            or the grabber clears the pieces ("clear" in wait).
+            The axes move at the same time, but the gantry only leaves a square with a piece when that piece
+            clears the others, unless up is False.
+        """
+        z = self.height(p)
+        zc = self.clearance(p)
+        timeline = []
+
+        # Travel to the source, and lower the grabber to the clearance height on the way.
+        timeline.append(((x1,y1), zc, None, ("xy",)))
+        timeline.append((None, z, "close", ("z",)))
+
         if up == True:
-            self.down(p)
-        self.open()
-        self.up(p)
+            # Lift the piece just above the others, and travel as soon as it clears them.
+            timeline.append((None, zc, None, ("clear",)))
+            timeline.append(((x2,y2), None, None, ("xy",)))
+            timeline.append((None, z, "open", ("z",)))
+        else:
+            timeline.append(((x2,y2), None, "open", ("xy",)))
+
+        # Raise the grabber, and let the next motion start as soon as it clears the pieces.
+        timeline.append((None, 0, None, ("clear",)))
+        return timeline
+
+    def run(self,timeline,zc):
+        """
+            Executes a timeline of steps (see schedule), in which the grabber clears the pieces at height zc.
+        """
+        for xy, z, grabber, wait in timeline:
+            targets = {}
+            t = 0
+            if xy is not None:
+                xs, t = self.travel(xy[0],xy[1])
+                if "xy" in wait:
+                    targets.update(xs)
+            tz = np.abs(self.dz/self.sz)
+            if z is not None:
+                tz = self.lift(z)
+                if "z" in wait:
+                    targets[self.Z] = z
+                    t = max(t, tz)
+            if "clear" in wait:
+                targets[self.Z] = (min(zc, 0) - self.tol, max(zc, 0) + self.tol)
+                t = max(t, tz)
+            if targets:
+                self.wait(targets, t + self.slack)
+            if grabber == "close":
+                self.close()
+            elif grabber == "open":
+                self.open()
         return
         
-    def remove(self,p,x,y):
+    def remove(self,p,x,y,nxt=None):
         """
-            Removes a piece p from (x,y) to an edge of the board. 
+            Removes a piece p from (x,y) to a free square next to the board. The square is chosen such
+            that the gantry travels the shortest time to it, and from there to square nxt (if not None).
+        """
+        path = [] if nxt is None else [nxt]
+        slot = self.graveyard.allocate(lambda s: self.duration([s] + path, (x,y)))
+        if slot is None:
+            print("No free square next to the board.")
+            slot = self.edge(x,y)
+        else:
+            self.graveyard.put(slot,p)
+        self.transport(p,x,y,slot[0],slot[1],True)
+        return
+
+    def fetch(self,p,x,y,slot=None):
+        """
+            Brings a captured piece p back to (x,y), from the nearest square next to the board that holds
+            one (or from slot). Returns False if there is no such piece.
+        """
+        if slot is None:
+            slot = self.graveyard.find(p, lambda s: self.duration([s,(x,y)]))
+            if slot is None:
+                return False
+        self.graveyard.take(slot)
+        self.transport(p,slot[0],slot[1],x,y,True)
+        return True
+
+    def restore(self,current,target):
+        """
+            Sets up the pieces for a new game: moves every piece that is not on its square to the side of
+            the board, and then fills the empty squares with captured pieces.
+            Returns the squares that could not be filled.
+
+            :param dict current: piece on every occupied square (x,y) of the board.
+            :param dict target: piece on every occupied square (x,y) of the new game.
+        """
+        for (x,y), p in sorted(current.items()):
+            if target.get((x,y)) != p:
+                self.remove(p,x,y)
+        missing = []
+        for (x,y), p in sorted(target.items()):
+            if current.get((x,y)) != p and not self.fetch(p,x,y):
+                missing.append((x,y))
+        return missing
+
+    def edge(self,x,y):
+        """
+            Returns the square at the nearest edge of the board from (x,y).
         """
         xe = x
         ye = y
@@ -152,40 +330,139 @@ class Robot:
                 ye = -1
             else:
                 ye = 8
-                
-        # Move the captured piece to the side.
-        self.transport(p,x,y,xe,ye,True)
-        
-        return
+        return (xe, ye)
         
+    @tracing.timed("robot.goto")
     def goto(self,x,y):
         """
             Moves the robot
         """
-
-        # calculate the duration of the move
-        t = self.tsq * np.max([np.abs(x-self.xc),np.abs(y-self.yc)])
-        
+        targets, t = self.travel(x,y)
         if t > 0:
-            # calculate the speed of each coordinate
-            vx = np.abs((x-self.xc)*self.dx/t)
-            vy = np.abs((y-self.yc)*self.dy/t)
-            
-            # set the speed of each motor
-            self.BP.set_motor_limits(self.X, self.px, vx)
-            self.BP.set_motor_limits(self.Y, self.py, vy)
-
-            # move with correct speed to target position
-            self.BP.set_motor_position(self.X, x * self.dx)
-            self.BP.set_motor_position(self.Y, y * self.dy)
-
             # wait until the move is completed
-            time.sleep(t)
+            self.wait(targets, t + self.slack)
+        return
+
+    def travel(self,x,y):
+        """
+            Starts moving the gantry to (x,y), such that both axes follow their velocity profiles and
+            arrive at the same time. Returns the target positions of the motors and the predicted duration
+            of the move.
+        """
+        targets = {self.X: x * self.dx, self.Y: y * self.dy}
+        distances = {self.X: (x-self.xc)*self.dx, self.Y: (y-self.yc)*self.dy}
+        t = self.duration([(x,y)])
+
+        start = self.BP.time()
+        for port, d in distances.items():
+            if d == 0:
+                # hold the axis that stays, such that it cannot drift away while the other one moves
+                self.BP.set_motor_limits(port, self.power[port], self.profiles[port].speed)
+                self.BP.set_motor_position(port, targets[port])
+                continue
+
+            # the shorter axis cruises slower, such that it arrives together with the longer one
+            v = self.profiles[port].cruise(d, t)
+            limit = self.profiles[port].limit(0, d, v)
+            self.motions[port] = [targets[port], v, start, limit]
+
+            # move with the starting speed to the target position, and speed up while waiting
+            self.BP.set_motor_limits(port, self.power[port], limit)
+            self.BP.set_motor_position(port, targets[port])
 
-            # update the current position
-            self.xc, self.yc = (x, y)
+        # update the current position
+        self.xc, self.yc = (x, y)
+        return targets, t
+
+    def clear(self):
+        """
+            Starts moving the gantry to its initial position next to the board, and returns as soon as it
+            no longer hangs over the board. Returns the target positions of the motors and the predicted
+            duration of the whole move (see wait).
+        """
+        targets, t = self.travel(self.x0,self.y0)
+        lo, hi = sorted((7.5*self.dy, self.y0*self.dy))
+        self.wait({self.Y: (lo - self.tol, hi + self.tol)}, t + self.slack)
+        return targets, t
+
+    def duration(self,path,start=None):
+        """
+            Predicts the time (seconds) that the gantry needs to visit the squares of a path in turn,
+            starting at the current position (or at square start).
+
+            :param list path: (x, y) squares.
+        """
+        t = 0
+        xc, yc = (self.xc, self.yc) if start is None else start
+        for x, y in path:
+            t += max(self.profiles[self.X].duration((x-xc)*self.dx), self.profiles[self.Y].duration((y-yc)*self.dy))
+            xc, yc = x, y
+        return t
+
+    def ramp(self,now):
+        """
+            Raises the speed limits of the moving gantry motors while they accelerate, and lowers them
+            while they brake, such that they follow their velocity profiles.
+        """
+        for port, motion in list(self.motions.items()):
+            target, v, start, limit = motion
+            remaining = target - self.BP.get_motor_encoder(port)
+            if np.abs(remaining) <= self.tol:
+                del self.motions[port]
+                continue
+            new = self.profiles[port].limit(now - start, remaining, v)
+            if np.abs(new - limit) >= 0.05 * v:
+                self.BP.set_motor_limits(port, self.power[port], new)
+                motion[3] = new
         return
 
+    def measure(self,port,d,timeout=10):
+        """
+            Measures the top speed and the acceleration of a gantry motor, by moving it over d degrees and
+            back without speed limit. Returns (speed, accel), to be used as sx and ax, or sy and ay.
+        """
+        e0 = self.BP.get_motor_encoder(port)
+        self.BP.set_motor_limits(port, self.power[port], 0)
+        self.BP.set_motor_position(port, e0 + d)
+        samples = []
+        start = self.BP.time()
+        while self.BP.time() - start < timeout:
+            e = self.BP.get_motor_encoder(port)
+            samples.append((self.BP.time(), e))
+            if np.abs(e0 + d - e) <= self.tol:
+                break
+            self.BP.sleep(self.dt)
+        self.BP.set_motor_limits(port, self.power[port], self.profiles[port].speed)
+        self.BP.set_motor_position(port, e0)
+        self.wait({port: e0}, timeout)
+        return trajectory.fit(samples)
+
+    def height(self,p):
+        """
+            Position of the lifting motor at which the grabber holds piece p.
+        """
+        h = 0
+        if p.lower() in ["r", "n", "b"]:
+            h = self.hRNB
+        if p.lower() in ["k", "q"]:
+            h = self.hKQ
+        return self.dz + h
+
+    def clearance(self,p):
+        """
+            Position of the lifting motor at which piece p, held by the grabber, clears all other pieces.
+        """
+        return self.height(p) + self.hc
+
+    def lift(self,z):
+        """
+            Starts moving the grabber to height z, and returns the duration of the move.
+        """
+        t = np.abs((z - self.BP.get_motor_encoder(self.Z))/self.sz)
+        self.BP.set_motor_position(self.Z, z)
+        return t
+
+    @tracing.timed("robot.up")
     def up(self,p):
         """
             Lift the grabber.
@@ -196,9 +473,10 @@ class Robot:
         if p.lower() in ["k", "q"]:
             h = self.hKQ
         self.BP.set_motor_position(self.Z, 0)
-        time.sleep(np.abs((self.dz+h)/self.sz))
+        self.wait({self.Z: 0}, np.abs((self.dz+h)/self.sz) + self.slack)
         return
         
+    @tracing.timed("robot.down")
     def down(self,p):
         """
             Lower the grabber.
@@ -209,30 +487,91 @@ class Robot:
         if p.lower() in ["k", "q"]:
             h = self.hKQ
         self.BP.set_motor_position(self.Z, self.dz + h)
-        time.sleep(np.abs((self.dz+h)/self.sz))
+        self.wait({self.Z: self.dz + h}, np.abs((self.dz+h)/self.sz) + self.slack)
         return
         
     def close(self):
         """
             Close the grabber.
         """
-        self.BP.set_motor_power(self.H, -self.pu)
-        time.sleep(self.tu)
-        self.BP.set_motor_power(self.H, 0)
+        self.spin(self.H, -self.pu, self.tu)
         return
 
     def open(self):
         """
             Open the grabber.
         """
-        self.BP.set_motor_power(self.H, self.pu)
-        time.sleep(self.tu-self.du)
-        self.BP.set_motor_power(self.H, 0)
+        self.spin(self.H, self.pu, self.tu-self.du)
+        return
+
+    def wait(self,targets,timeout):
+        """
+            Waits until every motor has reached its target position, by polling the encoders.
+            Raises IOError if a motor stalled before it arrived, or if the motion timed out. The motors then
+            stop where they are, and the current position becomes the nearest square.
+
+            :param dict targets: target position (degrees) of every motor port, or a range (lo, hi).
+            :param float timeout: maximal duration of the motion (seconds).
+        """
+        start = self.BP.time()
+        progress = {}
+        while True:
+            now = self.BP.time()
+            self.ramp(now)
+            arrived = True
+            for port, target in targets.items():
+                e = self.BP.get_motor_encoder(port)
+                lo, hi = target if isinstance(target, tuple) else (target - self.tol, target + self.tol)
+                if lo <= e <= hi:
+                    continue
+                arrived = False
+
+                # remember when the motor last made progress
+                if port not in progress or abs(e - progress[port][0]) > 1:
+                    progress[port] = (e, now)
+                elif now - progress[port][1] > self.ts:
+                    self.halt(targets)
+                    raise IOError("Motor " + str(port) + " stalled at " + str(e) + " instead of " + str(target) + ".")
+            if arrived:
+                return True
+            if now - start > timeout:
+                self.halt(targets)
+                raise IOError("Motion timed out after " + str(timeout) + "s.")
+            self.BP.sleep(self.dt)
+
+    def halt(self,ports):
+        """
+            Stops the motors where they are, and takes the nearest square as the current position.
+        """
+        for port in ports:
+            self.BP.set_motor_position(port, self.BP.get_motor_encoder(port))
+            self.motions.pop(port, None)
+        self.xc = int(round(self.BP.get_motor_encoder(self.X) / self.dx))
+        self.yc = int(round(self.BP.get_motor_encoder(self.Y) / self.dy))
+        return
+
+    def spin(self,port,power,t):
+        """
+            Runs a motor with the given power until it stops turning (for instance when the grabber is
+            fully closed), but at least tm and at most t seconds.
+        """
+        self.BP.set_motor_power(port, power)
+        start = self.BP.time()
+        e, last = self.BP.get_motor_encoder(port), start
+        while self.BP.time() - start < t:
+            self.BP.sleep(self.dt)
+            now = self.BP.time()
+            f = self.BP.get_motor_encoder(port)
+            if abs(f - e) > 1:
+                e, last = f, now
+            elif now - last > self.th and now - start >= self.tm:
+                break
+        self.BP.set_motor_power(port, 0)
         return
         
     def h(self,t,p):
         self.BP.set_motor_power(self.H, p)
-        time.sleep(t)
+        self.BP.sleep(t)
         self.BP.set_motor_power(self.H, 0)
         return
 
@@ -0,0 +1,32 @@
+from __future__ import print_function
+from __future__ import division
+
+import threading
+
+def warm_up(*tasks):
+    """
+        Runs slow start-up functions at the same time (such as starting the engine, letting the exposure of
+        the camera settle and resetting the motors), and returns their results in the same order once all
+        of them finished. Raises the first error, if any of them failed.
+
+        :param tasks: Functions without arguments.
+    """
+    results = [None] * len(tasks)
+    errors = [None] * len(tasks)
+
+    def run(k):
+        try:
+            results[k] = tasks[k]()
+        except Exception as error:
+            errors[k] = error
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(len(tasks))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
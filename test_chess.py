@@ -0,0 +1,109 @@
+from __future__ import print_function
+from __future__ import division
+
+import unittest
+
+import chess
+
+def position(fen, castling=0):
+    """
+        Sets up the pieces of a FEN string with white to move. FEN writes white in uppercase, and this
+        repository in lowercase.
+    """
+    p = chess.Position()
+    for i, row in enumerate(fen.split("/")):
+        x = 0
+        for c in row:
+            if c.isdigit():
+                x += int(c)
+            else:
+                p[x + 16*(7-i)] = ord(c.swapcase())
+                x += 1
+    p = chess.Position(p.board)
+    p.castling = castling
+    p.hash = p.zobrist()
+    return p
+
+def perft(p, depth):
+    """
+        Counts the leaf nodes of the tree of legal moves.
+    """
+    if depth == 0:
+        return 1
+    n = 0
+    for mv in p.legal():
+        undo = p.make(mv)
+        n += perft(p, depth-1)
+        p.unmake(undo)
+    return n
+
+def scores(squares, change=chess.Game.change):
+    """
+        Change scores (see Camera.changes) in which only the given squares changed.
+    """
+    s = [[0]*8 for x in range(8)]
+    for x, y in squares:
+        s[x][y] = change
+    return s
+
+class PerftTest(unittest.TestCase):
+    """
+        Node counts of well known positions, from https://www.chessprogramming.org/Perft_Results.
+    """
+
+    def check(self, p, counts):
+        h = p.hash
+        for depth, n in enumerate(counts, 1):
+            self.assertEqual(perft(p, depth), n)
+        self.assertEqual(p.hash, h)
+
+    def test_initial(self):
+        self.check(chess.Position().setup(), [20, 400, 8902])
+
+    def test_kiwipete(self):
+        p = position("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R",
+                     chess.WK | chess.WQ | chess.BK | chess.BQ)
+        self.check(p, [48, 2039, 97862])
+
+    def test_position3(self):
+        self.check(position("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8"), [14, 191, 2812, 43238])
+
+    def test_position4(self):
+        p = position("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1", chess.BK | chess.BQ)
+        self.check(p, [6, 264, 9467])
+
+    def test_position5(self):
+        p = position("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R", chess.WK | chess.WQ)
+        self.check(p, [44, 1486, 62379])
+
+class GameTest(unittest.TestCase):
+
+    def play(self, moves):
+        G = chess.Game()
+        G.new_game()
+        for m in moves.split():
+            G.move(m)
+        return G
+
+    def test_illegal_move(self):
+        G = self.play("e2e4 e7e5")
+        for m in ["e4e5", "e1e3", "d1d8", "e1g1", "a2a5"]:
+            self.assertRaises(ValueError, G.move, m)
+        self.assertEqual(G.moves, ["e2e4", "e7e5"])
+        self.assertEqual(len(G.history), 3)
+
+    def test_infer_castling(self):
+        G = self.play("e2e4 e7e5 g1f3 b8c6 f1c4 g8f6")
+        m, confidence = G.infer_move(scores([(4,0), (5,0), (6,0), (7,0)]))
+        self.assertEqual(m, "e1g1")
+        self.assertGreater(confidence, G.confidence)
+
+    def test_infer_enpassant(self):
+        G = self.play("e2e4 a7a6 e4e5 d7d5")
+        m, confidence = G.infer_move(scores([(4,4), (3,5), (3,4)]))
+        self.assertEqual(m, "e5d6")
+        self.assertGreater(confidence, G.confidence)
+        self.assertTrue(G.is_enpassant(m))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+from __future__ import print_function
+from __future__ import division
+
+import json
+import time
+import argparse
+import functools
+import threading
+
+# Tracer that the timed functions report to, or None to record nothing
+tracer = None
+
+class Tracer:
+    """
+        Records how long the phases of every turn take (such as taking a picture, searching or moving the
+        gantry), to find out whether the camera, the engine or the gantry is the bottleneck.
+        Every phase becomes an event with its name, the turn, its start time (seconds since the tracer
+        started), its duration and the thread. The events can be appended to a log file as JSON lines,
+        summarised per phase, and exported as a Chrome trace (chrome://tracing).
+    """
+
+    def __init__(self, path=None):
+        """
+            :param string path: File that every event is appended to as a line of JSON, or None.
+        """
+        self.events = []
+        self.turn = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.file = open(path, "a") if path is not None else None
+
+    def record(self, name, start, end):
+        """
+            Records a phase from time start to time end (see time.time).
+        """
+        event = {"name": name, "turn": self.turn, "start": start - self.started, "duration": end - start,
+                 "thread": threading.current_thread().name}
+        with self.lock:
+            self.events.append(event)
+            if self.file is not None:
+                self.file.write(json.dumps(event) + "\n")
+                self.file.flush()
+        return
+
+    def next(self):
+        """
+            Starts the next turn.
+        """
+        with self.lock:
+            self.turn += 1
+        return
+
+    def durations(self):
+        """
+            Returns the durations of every phase, by name.
+        """
+        durations = {}
+        with self.lock:
+            for event in self.events:
+                durations.setdefault(event["name"], []).append(event["duration"])
+        return durations
+
+    def summary(self):
+        """
+            Returns the number of calls, the total, the median and the 95th percentile of the duration of
+            every phase, by name.
+        """
+        summary = {}
+        for name, durations in self.durations().items():
+            durations.sort()
+            summary[name] = {"count": len(durations), "total": sum(durations),
+                             "p50": percentile(durations, 50), "p95": percentile(durations, 95)}
+        return summary
+
+    def report(self):
+        """
+            Prints the summary, with the phases that took most time first.
+        """
+        summary = self.summary()
+        print("%-20s %6s %9s %9s %9s" % ("phase", "count", "total", "p50", "p95"))
+        for name in sorted(summary, key=lambda name: -summary[name]["total"]):
+            s = summary[name]
+            print("%-20s %6d %9.3f %9.3f %9.3f" % (name, s["count"], s["total"], s["p50"], s["p95"]))
+        return
+
+    def chrome(self, path):
+        """
+            Writes the events in the trace event format of Chrome.
+        """
+        threads = {}
+        events = []
+        with self.lock:
+            for event in self.events:
+                tid = threads.setdefault(event["thread"], len(threads))
+                events.append({"name": event["name"], "ph": "X", "pid": 0, "tid": tid,
+                               "ts": int(event["start"] * 1e6), "dur": int(event["duration"] * 1e6),
+                               "args": {"turn": event["turn"]}})
+        for name, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": name}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+        return
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        return
+
+def percentile(values, p):
+    """
+        Returns the p-th percentile of sorted values, by the nearest rank.
+    """
+    if not values:
+        return 0
+    k = max(int(-(-p * len(values) // 100)) - 1, 0)
+    return values[min(k, len(values) - 1)]
+
+def timed(name):
+    """
+        Decorator that records every call of a function as a phase, if there is a tracer.
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            t = tracer
+            if t is None:
+                return f(*args, **kwargs)
+            start = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                t.record(name, start, time.time())
+        return wrapper
+    return decorate
+
+def read(path):
+    """
+        Reads the log file of a tracer.
+    """
+    t = Tracer()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                t.events.append(json.loads(line))
+    if t.events:
+        t.turn = max(event["turn"] for event in t.events)
+    return t
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarises the log of a tracer per phase.")
+    parser.add_argument("log", help="log file of a game (JSON lines)")
+    parser.add_argument("--chrome", help="also write the events as a Chrome trace to this file")
+    args = parser.parse_args()
+    t = read(args.log)
+    t.report()
+    if args.chrome:
+        t.chrome(args.chrome)
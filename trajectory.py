@@ -0,0 +1,90 @@
+from __future__ import print_function
+from __future__ import division
+
+import math
+
+class Profile:
+    """
+        Trapezoidal velocity profile of a motor: it accelerates at a constant rate up to its top speed,
+        cruises, and brakes at the same rate. A short move never reaches the top speed, and accelerates
+        until halfway instead (triangular profile).
+    """
+
+    # Top speed (degree/second)
+    speed = 500
+
+    # Acceleration and deceleration (degree/second^2)
+    accel = 2000
+
+    # Speed limit at the very start and end of a move (degree/second), since a limit of 0 means no limit
+    start = 50
+
+    def __init__(self, speed=None, accel=None):
+        if speed is not None:
+            self.speed = speed
+        if accel is not None:
+            self.accel = accel
+
+    def duration(self, d, speed=None):
+        """
+            Returns the time (seconds) to move over d degrees, starting and ending at rest.
+
+            :param float d: Distance (degrees).
+            :param float speed: Top speed (degree/second), if lower than the top speed of the motor.
+        """
+        d = abs(d)
+        v = self.speed if speed is None else min(speed, self.speed)
+        if d == 0 or v <= 0:
+            return 0
+        a = self.accel
+        if d <= v * v / a:
+            return 2 * math.sqrt(d / a)
+        return d / v + v / a
+
+    def cruise(self, d, t):
+        """
+            Returns the top speed at which a move over d degrees takes t seconds, such that a shorter move
+            can arrive together with a longer one. Returns the highest reachable speed if t is too short.
+        """
+        d = abs(d)
+        a = self.accel
+        if d == 0:
+            return 0
+
+        # Solve d = v t - v^2 / a for the lowest speed v.
+        discriminant = a * a * t * t - 4 * a * d
+        if discriminant <= 0:
+            return min(math.sqrt(a * d), self.speed)
+        return min((a * t - math.sqrt(discriminant)) / 2, self.speed)
+
+    def limit(self, elapsed, remaining, speed=None):
+        """
+            Returns the speed limit (degree/second) that makes a motor follow the profile, given the time
+            since the start of the move and the distance that remains.
+        """
+        v = self.speed if speed is None else min(speed, self.speed)
+        accelerate = self.start + self.accel * elapsed
+        brake = self.start + math.sqrt(2 * self.accel * abs(remaining))
+        return min(v, accelerate, brake)
+
+def fit(samples):
+    """
+        Estimates the top speed and the acceleration of a motor from encoder readings of a move that
+        starts at rest, for instance recorded by Robot.measure. Returns (speed, accel).
+
+        :param list samples: (time, degrees) tuples, in order of time.
+    """
+    speeds = []
+    for (t1, e1), (t2, e2) in zip(samples, samples[1:]):
+        if t2 > t1:
+            speeds.append(((t1 + t2) / 2, abs(e2 - e1) / (t2 - t1)))
+    if not speeds:
+        raise ValueError("Too few samples")
+
+    # The acceleration phase ends when the motor reaches 90% of its top speed.
+    top = max(v for t, v in speeds)
+    for t, v in speeds:
+        if v >= 0.9 * top:
+            reach = t - samples[0][0]
+            break
+    return top, 0.9 * top / max(reach, 1e-3)
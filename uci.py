@@ -0,0 +1,397 @@
+from __future__ import print_function
+from __future__ import division
+
+import time
+import threading
+import contextlib
+import subprocess
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def parse_info(line):
+    """
+        Reads the depth, score and principal variation of an info line of the engine.
+        The score is a pair ("cp", centipawns) or ("mate", moves), from the point of view of the side to move,
+        or None if the line has no score.
+    """
+    words = line.split()
+    info = {"depth": 0, "score": None, "pv": []}
+    i = 1
+    while i < len(words):
+        if words[i] == "depth" and i + 1 < len(words):
+            info["depth"] = int(words[i+1])
+            i += 2
+        elif words[i] == "score" and i + 2 < len(words):
+            info["score"] = (words[i+1], int(words[i+2]))
+            i += 3
+        elif words[i] == "pv":
+            info["pv"] = words[i+1:]
+            break
+        else:
+            i += 1
+    return info
+
+class Engine:
+    """
+        Persistent connection to a UCI engine such as Stockfish.
+        The process is started on the first search, and a background thread collects its output.
+    """
+
+    # Command that starts the engine
+    path = "/usr/games/stockfish"
+    # ./stockfish_8_x64.exe
+
+    # Seconds to wait for the engine to answer uci or isready
+    timeout = 10
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self.process = None
+        self.lines = None
+        self.options = {}
+        self.info = []
+        self.searching = False
+        self.pondering = None
+        self.prediction = None
+
+    def start(self):
+        """
+            Starts the engine process and performs the uci/isready handshake.
+        """
+        if self.running():
+            return self
+        self.process = subprocess.Popen([self.path], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self.read, args=(self.process.stdout, self.lines))
+        reader.daemon = True
+        reader.start()
+        self.options = {}
+        self.searching = False
+        self.pondering = None
+        self.prediction = None
+        self.send("uci")
+        self.wait("uciok", self.timeout)
+        self.set_option("Ponder", "true")
+        self.ready()
+        return self
+
+    def read(self, stdout, lines):
+        """
+            Reads the output of the engine line by line, until the process terminates.
+        """
+        for line in iter(stdout.readline, b""):
+            lines.put(line.decode().rstrip())
+        lines.put(None)
+        return
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, command):
+        self.process.stdin.write((command + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        return
+
+    def wait(self, token, timeout=None):
+        """
+            Waits for a line of the engine that starts with token, and returns it.
+            The info lines that arrive in the meantime are kept in self.info.
+        """
+        while True:
+            try:
+                line = self.lines.get(timeout=timeout)
+            except queue.Empty:
+                raise IOError("Engine did not answer " + token + " within " + str(timeout) + "s")
+            if line is None:
+                raise IOError("Engine terminated")
+            if line.startswith("info"):
+                self.info.append(line)
+            if line.startswith(token):
+                return line
+
+    def ready(self):
+        """
+            Blocks until the engine has processed all commands.
+        """
+        self.send("isready")
+        self.wait("readyok", self.timeout)
+        return
+
+    def set_option(self, name, value):
+        """
+            Sets an option of the engine, unless it already has that value.
+        """
+        value = str(value)
+        if self.options.get(name) == value:
+            return
+        self.stop()
+        self.send("setoption name " + name + " value " + value)
+        self.options[name] = value
+        return
+
+    def position(self, moves):
+        self.send("position startpos moves " + ' '.join(moves))
+        return
+
+    def result(self, timeout=None, watch=None):
+        """
+            Waits for the end of the current search, and returns the best move and the expected reply.
+            If watch is given, it is called with every info line, and the search is stopped as soon as
+            it returns True.
+        """
+        while True:
+            line = self.wait("", timeout)
+            if line.startswith("bestmove"):
+                break
+            if watch is not None and line.startswith("info") and watch(line):
+                self.send("stop")
+                watch = None
+        words = line.split()
+        self.searching = False
+        best = words[1]
+        ponder = None
+        if len(words) > 3 and words[2] == "ponder":
+            ponder = words[3]
+        return best, ponder
+
+    def search(self, moves, move_time, watch=None):
+        """
+            Calculates the best move after the given moves from the initial position.
+            If the engine is pondering on exactly these moves, it continues that search.
+            Returns the best move and the reply the engine expects.
+
+            :param list moves: Moves of the game.
+            :param int move_time: Time that the engine is allowed to think in milliseconds.
+            :param watch: Function that decides from an info line whether to stop early (see result).
+        """
+        self.start()
+        if self.pondering is not None and self.pondering == list(moves):
+            self.pondering = None
+            self.send("ponderhit")
+        else:
+            self.stop()
+            self.info = []
+            self.position(moves)
+            self.send("go movetime " + str(int(move_time)))
+            self.searching = True
+        best, ponder = self.result(watch=watch)
+        self.predict(moves, best, ponder)
+        return best, ponder
+
+    def analyse(self, moves, move_time=None, depth=None):
+        """
+            Evaluates the position after the given moves at full strength.
+            Returns the best move and the score of the deepest info line (see parse_info).
+
+            :param list moves: Moves of the game.
+            :param int move_time: Time that the engine is allowed to think in milliseconds.
+            :param int depth: Depth of the search, instead of a time limit.
+        """
+        self.start()
+        self.stop()
+        self.set_option("Skill Level", 20)
+        self.info = []
+        self.position(moves)
+        if depth is not None:
+            self.send("go depth " + str(int(depth)))
+        else:
+            self.send("go movetime " + str(int(move_time)))
+        self.searching = True
+        best, ponder = self.result()
+        self.prediction = None
+        score = None
+        for line in reversed(self.info):
+            info = parse_info(line)
+            if info["score"] is not None:
+                score = info["score"]
+                break
+        return best, score
+
+    def predict(self, moves, best, ponder):
+        """
+            Remembers which reply is expected after best is played in the given line.
+        """
+        self.prediction = None
+        if ponder is not None:
+            self.prediction = (list(moves) + [best], ponder)
+        return
+
+    def ponder(self, moves, move_time):
+        """
+            Starts thinking on the expected reply, while the opponent is thinking.
+            Returns whether the engine is pondering.
+
+            :param list moves: Moves of the game, ending with the last move of the engine.
+            :param int move_time: Time that the engine is allowed to think in milliseconds, after the reply.
+        """
+        if not self.running() or self.prediction is None or self.prediction[0] != list(moves):
+            return False
+        self.stop()
+        line = list(moves) + [self.prediction[1]]
+        self.info = []
+        self.position(line)
+        self.send("go ponder movetime " + str(int(move_time)))
+        self.searching = True
+        self.pondering = line
+        return True
+
+    def stop(self):
+        """
+            Stops the current search, if any, and discards its result.
+        """
+        if self.searching and self.running():
+            self.send("stop")
+            self.result(self.timeout)
+        self.searching = False
+        self.pondering = None
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.quit()
+        return False
+
+    def quit(self):
+        """
+            Terminates the engine.
+        """
+        if self.running():
+            self.stop()
+            self.send("quit")
+            self.process.wait()
+        self.process = None
+        return
+
+    def kill(self):
+        """
+            Terminates the engine without asking, for instance when it does not respond.
+        """
+        if self.running():
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.searching = False
+        self.pondering = None
+        return
+
+class Pool:
+    """
+        A number of engines that are leased to one game or analysis job at a time.
+        Engines are started when they are first needed, checked before every lease, and restarted when they
+        crashed or hang. Clients that wait for an engine are served in order of arrival.
+    """
+
+    def __init__(self, size=2, path=None):
+        self.size = size
+        self.path = path
+        self.idle = []
+        self.count = 0
+        self.waiting = collections.deque()
+        self.lock = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+            Leases an engine, and waits until one is available if all of them are in use.
+
+            :param float timeout: Seconds to wait at most, or None to wait as long as necessary.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        ticket = object()
+        with self.lock:
+            self.waiting.append(ticket)
+            try:
+                while self.waiting[0] is not ticket or (not self.idle and self.count >= self.size):
+                    if deadline is None:
+                        self.lock.wait()
+                    elif deadline <= time.time():
+                        raise IOError("No engine available within " + str(timeout) + "s")
+                    else:
+                        self.lock.wait(deadline - time.time())
+                if self.idle:
+                    engine = self.idle.pop()
+                else:
+                    engine = Engine(self.path)
+                    self.count += 1
+            finally:
+                self.waiting.remove(ticket)
+                self.lock.notify_all()
+        try:
+            return self.check(engine)
+        except Exception:
+            self.discard(engine)
+            raise
+
+    def check(self, engine):
+        """
+            Makes sure that an engine is running, responsive and idle, and restarts it otherwise.
+        """
+        try:
+            engine.start()
+            engine.stop()
+            engine.send("ucinewgame")
+            engine.ready()
+        except IOError:
+            engine.kill()
+            engine.start()
+            engine.send("ucinewgame")
+            engine.ready()
+        return engine
+
+    def release(self, engine):
+        """
+            Returns a leased engine to the pool.
+        """
+        try:
+            engine.stop()
+        except IOError:
+            engine.kill()
+        with self.lock:
+            self.idle.append(engine)
+            self.lock.notify_all()
+        return
+
+    def discard(self, engine):
+        """
+            Removes a leased engine that cannot be used anymore, such that a new one can take its place.
+        """
+        engine.kill()
+        with self.lock:
+            self.count -= 1
+            self.lock.notify_all()
+        return
+
+    @contextlib.contextmanager
+    def lease(self, timeout=None):
+        """
+            Leases an engine for the duration of a with block.
+        """
+        engine = self.acquire(timeout)
+        try:
+            yield engine
+        finally:
+            self.release(engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        """
+            Terminates all idle engines.
+        """
+        with self.lock:
+            for engine in self.idle:
+                engine.quit()
+            self.count -= len(self.idle)
+            self.idle = []
+        return